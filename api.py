@@ -0,0 +1,276 @@
+import json
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, abort, current_app, request, url_for
+from flask_login import current_user
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import HTTPException
+from models import db, User, Snippet, SnippetBlob, Vote
+from queries import feed_query, feed_key, profile_query, paginate, get_snippet_or_404
+import cache
+import ranking
+import routing
+import writes
+
+# Versioned JSON API under /api/v1, signed in with the site's session cookie.
+#
+# Responses are compact JSON (no whitespace). Each resource has a default
+# field set, and ?fields=a,b,c narrows it. For snippet listings the choice
+# also narrows the SELECT, so a list without `content` never reads the code
+# bodies (`preview` and `line_count` come from the snippet row itself). Batch endpoints take ?ids=1,2,3 (at most MAX_IDS) and answer in one
+# query, so clients no longer fetch one snippet or vote state per card.
+# Anonymous GETs get the same conditional-GET handling as the HTML pages.
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_IDS = 100
+MAX_PAGE_SIZE = 50
+DEFAULT_PAGE_SIZE = 20
+
+TITLE_LENGTH = Snippet.title.type.length
+LANGUAGE_LENGTH = Snippet.language.type.length
+
+
+def _timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+# field -> (getter, columns it needs loaded)
+SNIPPET_FIELDS = {
+    'id': (lambda s: s.id, ()),
+    'title': (lambda s: s.title, (Snippet.title,)),
+    'content': (lambda s: s.content, (Snippet.content_hash, Snippet.legacy_content)),
+    'preview': (lambda s: s.preview, (Snippet.preview,)),
+    'line_count': (lambda s: s.line_count, (Snippet.line_count,)),
+    'language': (lambda s: s.language, (Snippet.language,)),
+    'is_public': (lambda s: bool(s.is_public), ()),
+    'created_at': (lambda s: _timestamp(s.created_at), ()),
+    'owner': (lambda s: s.owner.username, ()),
+    'score': (lambda s: s.score, ()),
+    'upvotes': (lambda s: s.upvotes, (Snippet.upvotes,)),
+    'downvotes': (lambda s: s.downvotes, (Snippet.downvotes,)),
+    'url': (lambda s: url_for('view_snippet', snippet_id=s.id, _external=True), ()),
+}
+SNIPPET_LIST_DEFAULT = ('id', 'title', 'language', 'is_public', 'created_at', 'owner', 'score')
+SNIPPET_DEFAULT = SNIPPET_LIST_DEFAULT + ('content', 'upvotes', 'downvotes')
+# Always loaded: the keys every sort order, permission check and card needs
+SNIPPET_BASE_COLUMNS = (Snippet.id, Snippet.user_id, Snippet.is_public, Snippet.created_at,
+                        Snippet.score, Snippet.hot_score)
+
+SCORE_FIELDS = {'score': Snippet.score, 'upvotes': Snippet.upvotes, 'downvotes': Snippet.downvotes}
+
+USER_FIELDS = {
+    'username': lambda u: u.username,
+    'country': lambda u: u.country,
+    'role': lambda u: 'admin' if u.id == 1 else 'moderator' if u.is_moderator else 'member',
+    'snippet_count': lambda u: u.snippet_count,
+    'reputation': lambda u: u.reputation,
+    'url': lambda u: url_for('profile', username=u.username, _external=True),
+}
+
+
+def respond(payload, status=200, headers=None):
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+    return current_app.response_class(body, status=status, headers=headers, mimetype='application/json')
+
+
+@bp.errorhandler(HTTPException)
+def http_error(error):
+    return respond({'error': error.description}, error.code)
+
+
+def login_required(view):
+    # 401 JSON rather than the redirect to the login page
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401, 'Login required.')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def requested_fields(known, default):
+    raw = request.args.get('fields')
+    if not raw:
+        return default
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in known]
+    if unknown:
+        abort(400, f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(known)}.")
+    return fields
+
+
+def requested_ids():
+    try:
+        ids = list(dict.fromkeys(int(part) for part in request.args.get('ids', '').split(',') if part.strip()))
+    except ValueError:
+        abort(400, 'ids must be a comma-separated list of integers.')
+    if not ids:
+        abort(400, 'ids is required.')
+    if len(ids) > MAX_IDS:
+        abort(400, f"At most {MAX_IDS} ids per request.")
+    return ids
+
+
+def snippet_columns(fields):
+    columns = list(SNIPPET_BASE_COLUMNS)
+    for name in fields:
+        columns.extend(SNIPPET_FIELDS[name][1])
+    return load_only(*columns)
+
+
+def load_bodies(snippets):
+    # One query for every blob on the page; Snippet.content then finds them
+    # in the session instead of fetching one per snippet
+    hashes = {s.content_hash for s in snippets if s.content_hash}
+    if hashes:
+        db.session.execute(db.select(SnippetBlob).where(SnippetBlob.hash.in_(hashes))).scalars().all()
+
+
+def dump_snippet(snippet, fields):
+    return {name: SNIPPET_FIELDS[name][0](snippet) for name in fields}
+
+
+def can_view(snippet):
+    return snippet.is_public or (current_user.is_authenticated and snippet.user_id == current_user.id)
+
+
+def listing_version():
+    username = request.args.get('user')
+    return f"profile:{username}" if username else 'feed'
+
+
+# Snippets
+
+@bp.get('/snippets')
+@cache.conditional(listing_version, clock=lambda: ranking.feed_clock(request.args.get('window')))
+@routing.read_only
+def list_snippets():
+    # Public feed (?sort=&window= as on the Public Vault), or one user's
+    # snippets newest first with ?user=<username>
+    fields = requested_fields(SNIPPET_FIELDS, SNIPPET_LIST_DEFAULT)
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    username = request.args.get('user')
+    if username:
+        user = db.first_or_404(db.select(User).filter_by(username=username), description='No such user.')
+        is_owner = current_user.is_authenticated and current_user.id == user.id
+        query, key = profile_query(user, include_private=is_owner), feed_key('new')
+    else:
+        sort, window = ranking.parse(request.args.get('sort'), request.args.get('window'))
+        query, key = feed_query(sort, window), feed_key(sort)
+    snippets, next_cursor = paginate(query.options(snippet_columns(fields)), request.args.get('cursor'), limit, key)
+    if 'content' in fields:
+        load_bodies(snippets)
+    return respond({'snippets': [dump_snippet(s, fields) for s in snippets], 'next_cursor': next_cursor})
+
+
+@bp.get('/snippets/<int:snippet_id>')
+@cache.conditional(lambda snippet_id: f'snippet:{snippet_id}')
+@routing.read_only
+def get_snippet(snippet_id):
+    fields = requested_fields(SNIPPET_FIELDS, SNIPPET_DEFAULT)
+    snippet = get_snippet_or_404(snippet_id)
+    if not can_view(snippet):
+        abort(403, 'This snippet is private.')
+    return respond(dump_snippet(snippet, fields))
+
+
+def snippet_input(partial):
+    # Validated column values from the JSON body; `partial` for PATCH
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, 'Expected a JSON object.')
+    values = {}
+    for name in ('title', 'content', 'language'):
+        if name in body:
+            if not isinstance(body[name], str) or not body[name].strip():
+                abort(400, f"{name} must be a non-empty string.")
+            values[name] = body[name].strip() if name != 'content' else body[name]
+        elif not partial and name != 'language':
+            abort(400, f"{name} is required.")
+    if len(values.get('title', '')) > TITLE_LENGTH:
+        abort(400, f"title is limited to {TITLE_LENGTH} characters.")
+    if len(values.get('language', '')) > LANGUAGE_LENGTH:
+        abort(400, f"language is limited to {LANGUAGE_LENGTH} characters.")
+    if 'is_public' in body:
+        if not isinstance(body['is_public'], bool):
+            abort(400, 'is_public must be true or false.')
+        values['is_public'] = body['is_public']
+    return values
+
+
+@bp.post('/snippets')
+@login_required
+def create_snippet():
+    values = snippet_input(partial=False)
+    snippet = writes.create_snippet(current_user, values['title'], values['content'],
+                                    values.get('language', 'javascript'), values.get('is_public', False))
+    location = url_for('api.get_snippet', snippet_id=snippet.id)
+    return respond(dump_snippet(snippet, SNIPPET_DEFAULT), 201, {'Location': location})
+
+
+@bp.patch('/snippets/<int:snippet_id>')
+@login_required
+def update_snippet(snippet_id):
+    snippet = get_snippet_or_404(snippet_id)
+    if snippet.user_id != current_user.id:
+        abort(403, 'Only the owner can edit this snippet.')
+    values = snippet_input(partial=True)
+    if values:
+        writes.update_snippet(snippet, current_user, **values)
+    return respond(dump_snippet(snippet, SNIPPET_DEFAULT))
+
+
+# Batch lookups
+
+@bp.get('/scores')
+@routing.read_only
+def scores():
+    # {"<id>": {"score": ..., "upvotes": ..., "downvotes": ...}} for the
+    # requested ids the caller may see; unknown or private ids are left out
+    fields = requested_fields(SCORE_FIELDS, tuple(SCORE_FIELDS))
+    ids = requested_ids()
+    visible = Snippet.is_public == True  # noqa: E712
+    if current_user.is_authenticated:
+        visible = db.or_(visible, Snippet.user_id == current_user.id)
+    rows = db.session.execute(
+        db.select(Snippet.id, *(SCORE_FIELDS[name] for name in fields)).where(Snippet.id.in_(ids), visible)
+    ).all()
+    return respond({'scores': {str(row[0]): dict(zip(fields, row[1:])) for row in rows}})
+
+
+@bp.get('/me/votes')
+@login_required
+@routing.read_only
+def my_votes():
+    # {"<id>": 1 | -1 | 0} for every requested id; 0 means no vote
+    ids = requested_ids()
+    cast = Vote.values_for(current_user.id, ids)
+    return respond({'votes': {str(snippet_id): cast.get(snippet_id, 0) for snippet_id in ids}})
+
+
+# Profiles
+
+@bp.get('/users')
+@routing.read_only
+def list_users():
+    # Profile summaries for ?names=a,b,c in one query; unknown names are left out
+    fields = requested_fields(USER_FIELDS, tuple(USER_FIELDS))
+    names = list(dict.fromkeys(name.strip() for name in request.args.get('names', '').split(',') if name.strip()))
+    if not names:
+        abort(400, 'names is required.')
+    if len(names) > MAX_IDS:
+        abort(400, f"At most {MAX_IDS} names per request.")
+    users = db.session.execute(db.select(User).where(User.username.in_(names))).scalars()
+    by_name = {user.username: user for user in users}
+    return respond({'users': [{name: USER_FIELDS[name](by_name[n]) for name in fields}
+                              for n in names if n in by_name]})
+
+
+@bp.get('/users/<username>')
+@cache.conditional(lambda username: f'profile:{username}')
+@routing.read_only
+def get_user(username):
+    fields = requested_fields(USER_FIELDS, tuple(USER_FIELDS))
+    user = db.first_or_404(db.select(User).filter_by(username=username), description='No such user.')
+    return respond({name: USER_FIELDS[name](user) for name in fields})
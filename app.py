@@ -1,8 +1,30 @@
 import os
-from flask import Flask, render_template, redirect, url_for, request, flash
+import zipfile
+import click
+from datetime import datetime, timedelta
+from flask import Flask, Response, abort, render_template, redirect, url_for, request, flash, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, Snippet, Vote, AdminLog
-from sqlalchemy import func, text
+from models import db, User, Snippet, SnippetBlob, VoteConflict
+from queries import (feed_query, feed_key, profile_query, profile_totals, paginate, get_snippet_or_404,
+                     log_filters, log_query, paginate_logs)
+import stats as site_stats
+import search
+import ranking
+import transfer
+import writes
+import api
+import audit
+import highlight
+import cache
+import metrics
+import routing
+import migrations
+import user_cache
+from passwords import hasher as password_hasher
+from audit import writer as audit_writer
+from votes import coalescer as vote_coalescer
+from blobs import codec as blob_codec
+from jobs import queue as job_queue, Worker
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
@@ -18,39 +40,37 @@ if db_url.startswith("postgres://"):
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    "pool_pre_ping": True,  # Checks connection health before every query
-    "pool_recycle": 300,    # Refreshes connections every 5 minutes to prevent SSL timeout
-    "pool_size": 5,         # Limits local connections to help with "Max Connections" issues
-    "max_overflow": 0,      # Prevents app from creating extra connections beyond pool_size
-}
-
+# Pool settings come from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+# DB_POOL_RECYCLE and DB_POOL_PRE_PING (replicas: DB_REPLICA_*; see routing.py).
+# Defaults: 5 connections and no overflow, to stay within small "Max
+# Connections" plans, with a pre-ping health check on every checkout and a
+# recycle every 5 minutes to avoid SSL timeouts. Under gunicorn,
+# gunicorn.conf.py sizes the pool to the worker's concurrency instead.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = routing.engine_options('DB_')
+
+# Before db.init_app so the engines are built with the instrumented pools
+metrics.init_app(app)
+routing.init_app(app)
 db.init_app(app)
-
-# Ensure tables are created on startup
-with app.app_context():
-    db.create_all()
-    # Migration hack: Increase password_hash length for existing tables
-    try:
-        db.session.execute(text('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(256)'))
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-    
-    # Migration hack: Add is_moderator column if not exists
-    try:
-        db.session.execute(text('ALTER TABLE "user" ADD COLUMN is_moderator BOOLEAN DEFAULT FALSE'))
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
+site_stats.init_app(app)
+audit_writer.init_app(app)
+highlight.init_app(app)
+cache.init_app(app)
+user_cache.init_app(app)
+password_hasher.init_app(app)
+vote_coalescer.init_app(app)
+blob_codec.init_app(app)
+job_queue.init_app(app)
 
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
 
+app.register_blueprint(api.bp)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(int(user_id))
 
 @app.template_filter('flag')
 def flag_filter(country_name):
@@ -71,10 +91,12 @@ def flag_filter(country_name):
 
 @app.context_processor
 def utility_processor():
-    def verified_badge(user_id):
-        # We need to fetch the user if we only have ID, or expect a user object.
-        # Given existing usage verified_badge(user.id), let's handle both.
-        user = User.query.get(user_id)
+    def verified_badge(user):
+        # Expects an already-loaded user (or any row carrying id/is_moderator).
+        # A bare id still works, resolving through the session identity map
+        # first so repeated lookups of the same user never hit the database.
+        if isinstance(user, int):
+            user = db.session.get(User, user)
         if not user:
             return ''
             
@@ -87,10 +109,29 @@ def utility_processor():
         return ''
     return dict(verified_badge=verified_badge)
 
+def feed_args():
+    # ?sort=new|trending|top&window=day|week|all, see ranking.py
+    return ranking.parse(request.args.get('sort'), request.args.get('window'))
+
 @app.route('/')
+@cache.conditional(lambda: 'feed', clock=lambda: ranking.feed_clock(feed_args()[1]))
+@routing.read_only
 def index():
-    public_snippets = Snippet.query.filter_by(is_public=True).order_by(Snippet.created_at.desc()).limit(10).all()
-    return render_template('index.html', snippets=public_snippets)
+    sort, window = feed_args()
+    public_snippets, next_cursor = paginate(feed_query(sort, window), request.args.get('cursor'), key=feed_key(sort))
+    return render_template('index.html', snippets=public_snippets, next_cursor=next_cursor, sort=sort, window=window)
+
+@app.get('/feed')
+@routing.read_only
+def feed_page():
+    # JSON "next page" for the infinite Public Vault
+    sort, window = feed_args()
+    snippets, next_cursor = paginate(feed_query(sort, window), request.args.get('cursor'), key=feed_key(sort))
+    return {
+        'html': render_template('_feed_cards.html', snippets=snippets),
+        'next_cursor': next_cursor,
+        'next_url': url_for('feed_page', sort=sort, window=window, cursor=next_cursor) if next_cursor else None,
+    }
 
 @app.get("/health")
 def health_check():
@@ -99,9 +140,8 @@ def health_check():
 def log_action(action, details=None, user_id=None):
     # Use provided user_id or current_user's id
     u_id = user_id or (current_user.id if current_user.is_authenticated else None)
-    log = AdminLog(admin_id=u_id, action=action, details=details)
-    db.session.add(log)
-    db.session.commit()
+    # Queued for the background batch writer; see audit.py
+    audit_writer.log(u_id, action, details)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -110,6 +150,10 @@ def login():
         password = request.form.get('password')
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password):
+            if user.password_needs_rehash():
+                # Stored with older hash parameters; upgrade while we have the plaintext
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             log_action("Login", f"User {username} logged in")
             return redirect(url_for('index'))
@@ -129,6 +173,8 @@ def register():
             user.set_password(password)
             db.session.add(user)
             db.session.commit()
+            site_stats.record_user_added(country)
+            cache.touch('stats')
             log_action("Register", f"New user registered: {username}", user_id=user.id)
             login_user(user)
             return redirect(url_for('index'))
@@ -142,61 +188,54 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/user/<username>')
+@cache.conditional(lambda username: f'profile:{username}')
+@routing.read_only
 def profile(username):
     user = User.query.filter_by(username=username).first_or_404()
     
-    # Determine visibility filter
-    if current_user.is_authenticated and current_user.id == user.id:
-        filter_kwargs = {'user_id': user.id}
-    else:
-        filter_kwargs = {'user_id': user.id, 'is_public': True}
-    
-    # Fetch snippets
-    snippets = Snippet.query.filter_by(**filter_kwargs).order_by(Snippet.created_at.desc()).all()
+    # Owners see their private snippets too
+    is_owner = current_user.is_authenticated and current_user.id == user.id
     
-    # Calculate stats
-    snippet_count = len(snippets)
+    # Fetch one page of snippets
+    snippets, next_cursor = paginate(profile_query(user, include_private=is_owner), request.args.get('cursor'))
     
-    # Calculate total score using aggregation
-    if snippets:
-        # Join Vote -> Snippet to filter by snippet criteria
-        total_score = db.session.query(func.sum(Vote.value))\
-            .join(Snippet)\
-            .filter(Snippet.user_id == user.id)\
-            .filter(Snippet.id.in_([s.id for s in snippets]))\
-            .filter(Vote.value == 1)\
-            .scalar() or 0
-    else:
-        total_score = 0
+    # Calculate stats; reputation is the upvote total across the visible snippets
+    snippet_count, total_score = profile_totals(user, include_private=is_owner)
         
-    return render_template('profile.html', user=user, snippets=snippets, snippet_count=snippet_count, total_score=total_score)
+    return render_template('profile.html', user=user, snippets=snippets, next_cursor=next_cursor,
+                           snippet_count=snippet_count, total_score=total_score)
+
+@app.get('/user/<username>/feed')
+@routing.read_only
+def profile_feed_page(username):
+    # JSON "next page" for a profile's snippet list
+    user = User.query.filter_by(username=username).first_or_404()
+    is_owner = current_user.is_authenticated and current_user.id == user.id
+    snippets, next_cursor = paginate(profile_query(user, include_private=is_owner), request.args.get('cursor'))
+    return {
+        'html': render_template('_profile_cards.html', snippets=snippets),
+        'next_cursor': next_cursor,
+        'next_url': url_for('profile_feed_page', username=username, cursor=next_cursor) if next_cursor else None,
+    }
 
 @app.route('/vote/<int:snippet_id>/<action>', methods=['POST'])
 @login_required
 def vote(snippet_id, action):
     snippet = Snippet.query.get_or_404(snippet_id)
-    if not snippet.is_public and snippet.owner != current_user:
+    if not snippet.is_public and snippet.user_id != current_user.id:
         return "Unauthorized", 403
     
-    vote = Vote.query.filter_by(user_id=current_user.id, snippet_id=snippet_id).first()
-    value = 1 if action == 'up' else -1
-
-    if vote:
-        if vote.value == value:
-            # User clicked same button -> remove vote (toggle off)
-            db.session.delete(vote)
-        else:
-            # Change vote
-            vote.value = value
-    else:
-        # New vote
-        new_vote = Vote(user_id=current_user.id, snippet_id=snippet_id, value=value)
-        db.session.add(new_vote)
-    
-    db.session.commit()
+    try:
+        score = writes.cast_vote(snippet, current_user.id, 1 if action == 'up' else -1)
+    except VoteConflict:
+        db.session.rollback()
+        message = "Another vote on this snippet was in progress, please try again."
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return {'error': message}, 409
+        return message, 409
     # If request is AJAX, return JSON, else redirect
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return {'score': snippet.score}
+        return {'score': score}
     return redirect(request.referrer or url_for('index'))
 
 @app.route('/snippet/new', methods=['GET', 'POST'])
@@ -207,17 +246,16 @@ def new_snippet():
         content = request.form.get('content')
         language = request.form.get('language')
         is_public = request.form.get('is_public') == 'on'
-        snippet = Snippet(title=title, content=content, language=language, is_public=is_public, owner=current_user)
-        db.session.add(snippet)
-        db.session.commit()
-        log_action("Create Snippet", f"Created snippet '{title}'")
+        writes.create_snippet(current_user, title, content, language, is_public)
         return redirect(url_for('profile', username=current_user.username))
     return render_template('snippet_edit.html', snippet=None)
 
 @app.route('/snippet/<int:snippet_id>')
+@cache.conditional(lambda snippet_id: f'snippet:{snippet_id}')
+@routing.read_only
 def view_snippet(snippet_id):
-    snippet = Snippet.query.get_or_404(snippet_id)
-    if not snippet.is_public and (not current_user.is_authenticated or snippet.owner != current_user):
+    snippet = get_snippet_or_404(snippet_id)
+    if not snippet.is_public and (not current_user.is_authenticated or snippet.user_id != current_user.id):
         return "Unauthorized", 403
     return render_template('snippet_view.html', snippet=snippet)
 
@@ -225,17 +263,18 @@ def view_snippet(snippet_id):
 @login_required
 def edit_snippet(snippet_id):
     snippet = Snippet.query.get_or_404(snippet_id)
-    if snippet.owner != current_user:
+    if snippet.user_id != current_user.id:
         flash('You do not have permission to edit this snippet.')
         return redirect(url_for('index'))
     
     if request.method == 'POST':
-        snippet.title = request.form.get('title')
-        snippet.content = request.form.get('content')
-        snippet.language = request.form.get('language')
-        snippet.is_public = request.form.get('is_public') == 'on'
-        db.session.commit()
-        log_action("Edit Snippet", f"Edited snippet '{snippet.title}'")
+        writes.update_snippet(
+            snippet, current_user,
+            title=request.form.get('title'),
+            content=request.form.get('content'),
+            language=request.form.get('language'),
+            is_public=request.form.get('is_public') == 'on',
+        )
         return redirect(url_for('profile', username=current_user.username))
         
     return render_template('snippet_edit.html', snippet=snippet)
@@ -244,12 +283,10 @@ def edit_snippet(snippet_id):
 @login_required
 def toggle_privacy(snippet_id):
     snippet = Snippet.query.get_or_404(snippet_id)
-    if snippet.owner != current_user:
+    if snippet.user_id != current_user.id:
         flash('Unauthorized')
         return redirect(url_for('index'))
-    snippet.is_public = not snippet.is_public
-    db.session.commit()
-    log_action("Toggle Privacy", f"Snippet '{snippet.title}' is now {'Public' if snippet.is_public else 'Private'}")
+    writes.set_visibility(snippet, current_user, not snippet.is_public)
     return redirect(request.referrer or url_for('profile', username=current_user.username))
 
 @app.route('/snippet/<int:snippet_id>/delete', methods=['POST'])
@@ -261,94 +298,40 @@ def delete_snippet(snippet_id):
     is_admin = current_user.id == 1
     is_mod = current_user.is_moderator
     
-    if snippet.owner != current_user and not is_admin and not is_mod:
+    if snippet.user_id != current_user.id and not is_admin and not is_mod:
         flash('You do not have permission to delete this snippet.')
         return redirect(url_for('index'))
     
     title = snippet.title
-    owner_name = snippet.owner.username
+    by_staff = snippet.user_id != current_user.id
+    writes.delete_snippet(snippet, current_user)
     
-    db.session.delete(snippet)
-    db.session.commit()
-    
-    # Log if deleted by staff
-    if (is_admin or is_mod) and snippet.owner != current_user:
-        log_action("Staff Delete Snippet", f"Deleted snippet '{title}' owned by {owner_name}")
+    if by_staff:
         flash(f'Snippet "{title}" deleted by staff.')
     else:
-        log_action("Delete Snippet", f"Deleted snippet '{title}'")
         flash(f'Snippet "{title}" deleted.')
         
     return redirect(url_for('profile', username=current_user.username))
 
 @app.route('/search')
+@routing.read_only
 def search_users():
-    query = request.args.get('q')
-    if query:
-        # Exact match redirect
-        user = User.query.filter_by(username=query).first()
-        if user:
-            return redirect(url_for('profile', username=user.username))
-        # Partial match list (simplified for now, just flash and redirect home if not found)
-        users = User.query.filter(User.username.contains(query)).all()
-        if len(users) == 1:
-             return redirect(url_for('profile', username=users[0].username))
-        elif users:
-            # We don't have a search results page, so for now let's just pick the first one or show a message.
-            # To be more useful, let's create a simple search results template or just redirect to the first match.
-            # Given constraints, I'll redirect to the first match but flash "Found X users"
-            flash(f'Found {len(users)} users. Redirecting to {users[0].username}.')
-            return redirect(url_for('profile', username=users[0].username))
-            
-        flash(f'No user found with name containing "{query}"')
-    return redirect(url_for('index'))
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return redirect(url_for('index'))
+    page = max(request.args.get('page', 1, type=int), 1)
+    viewer_id = current_user.id if current_user.is_authenticated else None
+    snippets, has_next = search.search_snippets(query, viewer_id=viewer_id, page=page)
+    # Username matches are shown alongside snippet hits on the first page
+    users = User.query.filter(User.username.contains(query)).order_by(User.username).limit(10).all() if page == 1 else []
+    return render_template('search.html', query=query, snippets=snippets, users=users, page=page, has_next=has_next)
 
 @app.route('/stats')
+@cache.conditional(lambda: 'stats')
+@routing.read_only
 def stats():
-    # 1. Total Users
-    user_count = User.query.count()
-    
-    # 2. Top 10 Users by Snippet Count
-    top_snippet_users = db.session.query(
-        User.username, 
-        User.country,
-        User.id,
-        User.is_moderator,
-        func.count(Snippet.id).label('count')
-    ).join(Snippet).group_by(User.id).order_by(text('count DESC')).limit(10).all()
-    
-    # 3. Top 10 Users by Reputation (Sum of votes on their snippets)
-    # logic: User -> Snippet -> Vote. Sum(Vote.value)
-    top_reputation_users = db.session.query(
-        User.username,
-        User.country,
-        User.id,
-        User.is_moderator,
-        func.sum(Vote.value).label('reputation')
-    ).join(Snippet, Snippet.user_id == User.id)\
-     .join(Vote, Vote.snippet_id == Snippet.id)\
-     .group_by(User.id)\
-     .order_by(text('reputation DESC'))\
-     .limit(10).all()
-     
-    # 4. Users by Country
-    country_stats = db.session.query(
-        User.country,
-        func.count(User.id).label('count')
-    ).group_by(User.country).all()
-    
-    # Format data for Chart.js
-    country_labels = [stat[0] for stat in country_stats]
-    country_data = [stat[1] for stat in country_stats]
-    
-    return render_template(
-        'stats.html', 
-        user_count=user_count,
-        top_snippet_users=top_snippet_users,
-        top_reputation_users=top_reputation_users,
-        country_labels=country_labels,
-        country_data=country_data
-    )
+    # Served from the in-process snapshot; see stats.py
+    return render_template('stats.html', **site_stats.get_stats())
 
 @app.route('/admin')
 @login_required
@@ -356,9 +339,49 @@ def admin_dashboard():
     if current_user.id != 1:
         flash('Unauthorized access')
         return redirect(url_for('index'))
-    users = User.query.all()
-    logs = AdminLog.query.order_by(AdminLog.timestamp.desc()).all()
-    return render_template('admin.html', users=users, logs=logs)
+    # Members: offset-paginated, optionally filtered by username
+    member_query = request.args.get('member', '').strip()
+    users_select = db.select(User).order_by(User.id)
+    if member_query:
+        users_select = users_select.where(User.username.contains(member_query))
+    users = db.paginate(users_select, page=request.args.get('page', 1, type=int), per_page=50, error_out=False)
+    # Logs: keyset-paginated and filterable
+    criteria, filters = admin_log_filters()
+    logs, next_cursor = paginate_logs(log_query(criteria), request.args.get('cursor'))
+    return render_template('admin.html', users=users, logs=logs, next_cursor=next_cursor,
+                           filters=filters, member_query=member_query,
+                           admin_jobs=ADMIN_JOBS, job_counts=job_queue.counts())
+
+def admin_log_filters():
+    # Parse ?action=&user=&since=&until= (dates as YYYY-MM-DD, until inclusive)
+    filters = {key: request.args.get(key, '').strip() for key in ('action', 'user', 'since', 'until')}
+    admin_id = None
+    if filters['user']:
+        user = User.query.filter_by(username=filters['user']).first()
+        admin_id = user.id if user else -1
+    try:
+        since = datetime.strptime(filters['since'], '%Y-%m-%d') if filters['since'] else None
+        until = datetime.strptime(filters['until'], '%Y-%m-%d') + timedelta(days=1) if filters['until'] else None
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format')
+        since = until = None
+    return log_filters(action=filters['action'], admin_id=admin_id, since=since, until=until), filters
+
+@app.route('/admin/logs/export.<fmt>')
+@login_required
+def admin_export_logs(fmt):
+    if current_user.id != 1:
+        flash('Unauthorized access')
+        return redirect(url_for('index'))
+    if fmt not in ('csv', 'ndjson'):
+        abort(404)
+    criteria, _ = admin_log_filters()
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(audit.stream_logs(criteria, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=admin-logs.{fmt}'},
+    )
 
 @app.route('/admin/verify/<int:user_id>', methods=['POST'])
 @login_required
@@ -375,6 +398,9 @@ def admin_verify_user(user_id):
     # Toggle moderator status
     user.is_moderator = not user.is_moderator
     db.session.commit()
+    user_cache.forget(user.id)
+    site_stats.invalidate()
+    cache.touch('site', 'stats')
     
     status = "Verified/Moderator" if user.is_moderator else "Unverified"
     log_action("Toggle Verify User", f"Changed {user.username} (ID: {user.id}) status to {status}")
@@ -396,11 +422,29 @@ def admin_delete_user(user_id):
     username = user.username
     user_id_val = user.id
     
-    db.session.delete(user)
-    db.session.commit()
+    writes.delete_user(user)
     
     log_action("Admin Delete User", f"Admin deleted user {username} (ID: {user_id_val})")
-    flash(f'User {username} deleted')
+    flash(f'User {username} is being deleted')
+    return redirect(url_for('admin_dashboard'))
+
+# Maintenance jobs the admin can queue from the dashboard
+ADMIN_JOBS = {
+    'reconcile_scores': 'Score reconciliation',
+    'rebuild_stats': 'Stats refresh',
+}
+
+@app.route('/admin/jobs/<kind>', methods=['POST'])
+@login_required
+def admin_queue_job(kind):
+    if current_user.id != 1:
+        flash('Unauthorized access')
+        return redirect(url_for('index'))
+    if kind not in ADMIN_JOBS:
+        abort(404)
+    job_queue.enqueue(kind)
+    log_action("Queue Job", f"Queued {ADMIN_JOBS[kind].lower()}")
+    flash(f'{ADMIN_JOBS[kind]} queued')
     return redirect(url_for('admin_dashboard'))
 
 @app.route('/settings', methods=['GET', 'POST'])
@@ -411,7 +455,8 @@ def settings():
         new_password = request.form.get('password')
         country = request.form.get('country')
         
-        user = User.query.get(current_user.id)
+        user = db.session.get(User, current_user.id)
+        shown_changed = False  # username or country: shown on every card and on /stats
         
         # Username change
         if new_username and new_username != user.username:
@@ -420,7 +465,10 @@ def settings():
                 return redirect(url_for('settings'))
             old_name = user.username
             user.username = new_username
+            db.session.flush()
+            search.reindex_user(user.id)
             log_action("Update Profile", f"Username changed from {old_name} to {new_username}")
+            shown_changed = True
             
         # Password change
         if new_password:
@@ -432,25 +480,192 @@ def settings():
             old_country = user.country
             user.country = country
             log_action("Update Profile", f"Country changed from {old_country} to {country}")
+            shown_changed = True
             
         db.session.commit()
+        user_cache.forget(user.id)
+        if shown_changed:
+            site_stats.invalidate()
+            cache.touch('site', 'stats')
+        else:
+            cache.touch(f'profile:{user.username}')
         flash('Profile updated successfully!')
         return redirect(url_for('profile', username=user.username))
     
-    user_logs = AdminLog.query.filter_by(admin_id=current_user.id).order_by(AdminLog.timestamp.desc()).all()
-    return render_template('settings.html', logs=user_logs)
+    user_logs, next_cursor = paginate_logs(log_query(log_filters(admin_id=current_user.id)), request.args.get('cursor'))
+    return render_template('settings.html', logs=user_logs, next_cursor=next_cursor)
+
+@app.get('/export/snippets.<fmt>')
+@login_required
+def export_snippets(fmt):
+    if fmt not in ('ndjson', 'zip'):
+        abort(404)
+    everything = request.args.get('scope') == 'all'
+    if everything and current_user.id != 1:
+        flash('Unauthorized access')
+        return redirect(url_for('index'))
+    user_id = None if everything else current_user.id
+    stream = transfer.stream_zip(user_id) if fmt == 'zip' else transfer.stream_ndjson(user_id)
+    name = 'codesnap' if everything else current_user.username
+    return Response(
+        stream_with_context(stream),
+        mimetype='application/zip' if fmt == 'zip' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={name}-snippets.{fmt}'},
+    )
+
+@app.post('/import/snippets')
+@login_required
+def import_snippets():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose an export file to import.')
+        return redirect(url_for('settings') + '#backup')
+    # The admin may restore a whole-instance export with its owners and votes
+    everything = current_user.id == 1 and request.form.get('keep_owners') == 'on'
+    try:
+        summary = transfer.import_records(
+            transfer.read_records(upload.stream),
+            owner_id=None if everything else current_user.id,
+            include_votes=everything,
+        )
+    except (transfer.TransferFormatError, zipfile.BadZipFile) as e:
+        cache.touch('site', 'stats')  # chunks before the bad record are kept
+        flash(f'Import stopped: {e}')
+        return redirect(url_for('settings') + '#backup')
+    cache.touch('site', 'stats')
+    log_action("Import Snippets", transfer.describe(summary))
+    flash(f'Imported {transfer.describe(summary)}.')
+    return redirect(url_for('profile', username=current_user.username))
 
 @app.route('/settings/delete', methods=['POST'])
 @login_required
 def delete_account():
-    user = User.query.get(current_user.id)
+    user = db.session.get(User, current_user.id)
     username = user.username
     log_action("Delete Account", f"User {username} deleted their own account")
     logout_user()
-    db.session.delete(user)
-    db.session.commit()
-    flash('Your account has been permanently deleted.')
+    writes.delete_user(user)
+    flash('Your account is being permanently deleted.')
     return redirect(url_for('index'))
 
+@app.cli.command('reconcile-scores')
+def reconcile_scores_command():
+    """Rebuild snippet score counters from the Vote table, and user totals from those."""
+    snippets, users = writes.reconcile_scores()
+    print(f"✅ Reconciled vote counters ({snippets} snippets and {users} users corrected).")
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute all leaderboard counters from scratch."""
+    writes.rebuild_stats()
+    print("✅ Rebuilt vote counters and per-user stats.")
+
+@app.cli.command('rebuild-rankings')
+def rebuild_rankings_command():
+    """Recompute every snippet's trending (hot) score."""
+    updated = ranking.rebuild()
+    print(f"✅ Rebuilt snippet rankings ({updated} snippets changed).")
+
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    """Rebuild the full-text snippet search index."""
+    search.rebuild()
+    print("✅ Rebuilt the snippet search index.")
+
+@app.cli.command('backfill-blobs')
+@click.option('--batch', default=500, show_default=True, help='Snippets moved per transaction.')
+def backfill_blobs_command(batch):
+    """Move snippet bodies from the old content column into compressed blobs."""
+    moved = Snippet.backfill_blobs(batch, echo=lambda done: print(f"  {done} snippets moved..."))
+    count, text_bytes, stored_bytes = SnippetBlob.totals()
+    print(f"✅ Moved {moved} snippets. {count} blobs hold {text_bytes} bytes of code in {stored_bytes} bytes.")
+
+@app.cli.command('prune-blobs')
+@click.option('--hours', default=1, show_default=True, help='Keep unreferenced blobs newer than this.')
+def prune_blobs_command(hours):
+    """Delete snippet blobs no snippet refers to any more."""
+    removed = SnippetBlob.prune(datetime.utcnow() - timedelta(hours=hours))
+    print(f"✅ Pruned {removed} unreferenced blobs.")
+
+@app.cli.command('worker')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+def worker_command(burst):
+    """Run background jobs (see jobs.py)."""
+    done = Worker(job_queue).run(burst=burst)
+    print(f"✅ Ran {done} jobs.")
+
+@app.cli.command('jobs')
+@click.option('--retry', is_flag=True, help='Queue every failed job again.')
+def jobs_command(retry):
+    """Show background job counts and recent failures."""
+    if retry:
+        print(f"✅ Requeued {job_queue.retry_failed()} failed jobs.")
+    counts = job_queue.counts()
+    print('  '.join(f"{status}: {counts.get(status, 0)}" for status in ('queued', 'running', 'done', 'failed')))
+    for job in job_queue.failed():
+        error = (job.last_error or '').strip().splitlines()[-1:] or ['']
+        print(f"  #{job.id} {job.kind} {job.payload}  after {job.attempts} attempts: {error[0]}")
+
+@app.cli.command('compact-logs')
+@click.option('--days', default=90, show_default=True, help='Keep entries newer than this many days intact.')
+def compact_logs_command(days):
+    """Roll old audit log entries up into daily summary rows."""
+    day_count, removed = audit.compact(older_than_days=days)
+    print(f"✅ Compacted {removed} log entries across {day_count} days.")
+
+@app.cli.command('migrate')
+@click.option('--status', 'show_status', is_flag=True, help='List migrations instead of applying them.')
+def migrate_command(show_status):
+    """Apply pending schema migrations."""
+    if show_status:
+        for version, name, applied_at in migrations.status():
+            state = f"applied {applied_at:%Y-%m-%d %H:%M}" if applied_at else 'pending'
+            print(f"{version:>3}  {state:<24}  {name}")
+        return
+    ran = migrations.upgrade(echo=print)
+    print(f"✅ Applied {len(ran)} migrations." if ran else "✅ Schema is up to date.")
+
+@app.cli.command('export-snippets')
+@click.argument('output', type=click.File('wb'))
+@click.option('--user', 'username', help="Export only this user's snippets (default: everything).")
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'zip']), default='ndjson', show_default=True)
+def export_snippets_command(output, username, fmt):
+    """Stream snippets and their votes to an NDJSON or ZIP file."""
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f"No user named {username}")
+        user_id = user.id
+    stream = transfer.stream_zip(user_id) if fmt == 'zip' else transfer.stream_ndjson(user_id)
+    for chunk in stream:
+        output.write(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+    print(f"✅ Exported {'@' + username if username else 'all'} snippets to {output.name}.")
+
+@app.cli.command('import-snippets')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--owner', help="Import every snippet into this user's account (votes are skipped).")
+@click.option('--no-votes', is_flag=True, help='Skip vote records.')
+def import_snippets_command(path, owner, no_votes):
+    """Bulk import an NDJSON or ZIP export."""
+    owner_id = None
+    if owner:
+        user = User.query.filter_by(username=owner).first()
+        if not user:
+            raise click.ClickException(f"No user named {owner}")
+        owner_id = user.id
+    with open(path, 'rb') as fh:
+        try:
+            summary = transfer.import_records(transfer.read_records(fh), owner_id, include_votes=not no_votes)
+        except (transfer.TransferFormatError, zipfile.BadZipFile) as e:
+            cache.touch('site', 'stats')
+            raise click.ClickException(f"Import stopped: {e}")
+    cache.touch('site', 'stats')
+    audit_writer.log(owner_id, 'Import Snippets', transfer.describe(summary))
+    print(f"✅ {transfer.describe(summary)}.")
+
 if __name__ == '__main__':
+    # The dev server migrates itself; deploys run migrate.py once instead
+    with app.app_context():
+        migrations.upgrade()
     app.run(debug=True, port=5001)
@@ -0,0 +1,202 @@
+import atexit
+import csv
+import io
+import json
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from models import db, User, AdminLog
+
+# Batched audit log writer. log_action() used to add an AdminLog row and
+# commit on every login, logout and edit, doubling the transactions per
+# request and holding a pooled connection for each. Events now go onto a
+# bounded in-process queue, and one background thread per process bulk
+# inserts them. It writes when a batch fills or the flush interval passes,
+# and drains the queue on shutdown.
+#
+# AUDIT_LOG_MODE = 'sync' (or TESTING) writes each event inline instead,
+# so tests can read the log straight after the request that produced it.
+
+_STOP = object()
+
+
+class AuditWriter:
+    def __init__(self):
+        self.app = None
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_LOG_MODE', os.environ.get('AUDIT_LOG_MODE', 'async'))
+        app.config.setdefault('AUDIT_LOG_BATCH_SIZE', int(os.environ.get('AUDIT_LOG_BATCH_SIZE', 100)))
+        app.config.setdefault('AUDIT_LOG_FLUSH_INTERVAL', float(os.environ.get('AUDIT_LOG_FLUSH_INTERVAL', 1.0)))
+        app.config.setdefault('AUDIT_LOG_QUEUE_SIZE', int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000)))
+        self.app = app
+        atexit.register(self.shutdown)
+
+    @property
+    def synchronous(self):
+        return self.app.config['AUDIT_LOG_MODE'] == 'sync' or self.app.testing
+
+    def log(self, admin_id, action, details=None):
+        event = {'admin_id': admin_id, 'action': action, 'details': details, 'timestamp': datetime.utcnow()}
+        if self.synchronous:
+            self._write([event])
+            return
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Apply backpressure rather than dropping audit records
+            self._write([event])
+
+    def _ensure_started(self):
+        # Lazily start one writer per process, so forked (preloaded)
+        # gunicorn workers each get their own thread
+        if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            self.queue = queue.Queue(maxsize=self.app.config['AUDIT_LOG_QUEUE_SIZE'])
+            self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def _run(self):
+        batch_size = self.app.config['AUDIT_LOG_BATCH_SIZE']
+        interval = self.app.config['AUDIT_LOG_FLUSH_INTERVAL']
+        batch = []
+        deadline = time.monotonic() + interval
+        while True:
+            try:
+                event = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                event = None
+            if event is _STOP:
+                self._flush(batch)
+                self.queue.task_done()
+                return
+            if event is not None:
+                batch.append(event)
+            if len(batch) >= batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + interval
+
+    def _flush(self, batch):
+        if batch:
+            with self.app.app_context():
+                try:
+                    self._write(batch)
+                except Exception:
+                    self.app.logger.exception('Failed to write %d audit log entries', len(batch))
+        for _ in batch:
+            self.queue.task_done()
+
+    def _write(self, events):
+        # One executemany INSERT for the whole batch. Events can outlive the
+        # user they name (e.g. "Delete Account"), so on a foreign key failure
+        # retry row by row and keep the entry without its user link.
+        try:
+            db.session.execute(db.insert(AdminLog), events)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            for event in events:
+                try:
+                    db.session.execute(db.insert(AdminLog), [event])
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    db.session.execute(db.insert(AdminLog), [dict(event, admin_id=None)])
+                    db.session.commit()
+
+    def flush(self):
+        # Block until everything queued so far has been written
+        if self.queue is not None and self.pid == os.getpid():
+            self.queue.join()
+
+    def shutdown(self, timeout=10):
+        if self.thread and self.thread.is_alive() and self.pid == os.getpid():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+
+
+writer = AuditWriter()
+
+
+# Streamed export. Rows are fetched yield_per at a time on a server-side
+# cursor and written out in ~64KB chunks, so an export of any size never
+# holds more than one chunk in memory.
+
+EXPORT_COLUMNS = ('id', 'timestamp', 'admin_id', 'username', 'action', 'details')
+EXPORT_CHUNK_SIZE = 1000
+
+
+def stream_logs(criteria, fmt):
+    stmt = db.select(
+        AdminLog.id, AdminLog.timestamp, AdminLog.admin_id, User.username, AdminLog.action, AdminLog.details
+    ).outerjoin(User, User.id == AdminLog.admin_id)\
+        .where(*criteria)\
+        .order_by(AdminLog.timestamp.desc(), AdminLog.id.desc())\
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    buffer = io.StringIO()
+    csv_writer = csv.writer(buffer) if fmt == 'csv' else None
+    if csv_writer:
+        csv_writer.writerow(EXPORT_COLUMNS)
+    for row in db.session.execute(stmt):
+        record = dict(zip(EXPORT_COLUMNS, row))
+        record['timestamp'] = record['timestamp'].isoformat() if record['timestamp'] else None
+        if csv_writer:
+            csv_writer.writerow(record.values())
+        else:
+            buffer.write(json.dumps(record, separators=(',', ':')) + '\n')
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Retention. Entries older than the cutoff are compacted, one day at a time,
+# into one "Rollup: <action>" row per (day, user, action) that records how
+# many entries it replaced. Rollup rows are never compacted again.
+
+ROLLUP_PREFIX = 'Rollup: '
+
+
+def compact(older_than_days=90):
+    cutoff = datetime.combine(datetime.utcnow().date() - timedelta(days=older_than_days), datetime.min.time())
+    live = ~AdminLog.action.startswith(ROLLUP_PREFIX)
+    days = db.session.execute(
+        db.select(func.date(AdminLog.timestamp)).where(AdminLog.timestamp < cutoff, live).distinct()
+    ).scalars().all()
+    removed = 0
+    for day in sorted(date.fromisoformat(str(d)) for d in days):
+        start = datetime.combine(day, datetime.min.time())
+        window = (AdminLog.timestamp >= start, AdminLog.timestamp < start + timedelta(days=1), live)
+        groups = db.session.execute(
+            db.select(AdminLog.admin_id, AdminLog.action, func.count(AdminLog.id))
+            .where(*window).group_by(AdminLog.admin_id, AdminLog.action)
+        ).all()
+        db.session.execute(db.insert(AdminLog), [
+            {
+                'admin_id': admin_id,
+                'action': (ROLLUP_PREFIX + action)[:100],
+                'details': f"{count} entries on {day.isoformat()}",
+                'timestamp': start,
+            }
+            for admin_id, action, count in groups
+        ])
+        removed += db.session.execute(
+            db.delete(AdminLog).where(*window).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    return len(days), removed
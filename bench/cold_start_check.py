@@ -0,0 +1,76 @@
+"""Check that pages work as the first request of a fresh process.
+
+Usage:
+    python bench/cold_start_check.py
+
+A temporary SQLite database gets one user, one public snippet and one audit
+log entry. Then each of these runs as the very first request of its own new
+Python process, before any login or other query:
+
+  * GET /snippet/<id>
+  * GET /api/v1/snippets/<id>
+  * the admin audit log query (queries.log_query)
+
+Eager loads such as joinedload(Snippet.owner) fail there if a relationship
+only exists once the mappers have been configured by some earlier query.
+Exits non-zero if any check fails.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = """
+from app import app
+from models import db, User, Snippet, AdminLog
+import migrations
+with app.app_context():
+    migrations.upgrade()
+    user = User(username='cold-start', password_hash='!')
+    db.session.add(user)
+    db.session.flush()
+    snippet = Snippet(title='Cold start', content='pass', language='python', is_public=True, user_id=user.id)
+    db.session.add_all([snippet, AdminLog(admin_id=user.id, action='Cold start', details='')])
+    db.session.commit()
+    print(snippet.id)
+"""
+
+CHECKS = [
+    ('GET /snippet/<id>', "from app import app\n"
+                          "status = app.test_client().get('/snippet/{id}').status_code\n"
+                          "assert status == 200, status"),
+    ('GET /api/v1/snippets/<id>', "from app import app\n"
+                                  "status = app.test_client().get('/api/v1/snippets/{id}').status_code\n"
+                                  "assert status == 200, status"),
+    ('audit log query', "from app import app\n"
+                        "import queries\n"
+                        "with app.app_context():\n"
+                        "    assert queries.log_query().all()"),
+]
+
+
+def main():
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'cold.db')}",
+               AUDIT_LOG_MODE='sync', JOBS_MODE='sync')
+    env.pop('DATABASE_REPLICA_URLS', None)
+    seeded = subprocess.run([sys.executable, '-c', SEED], cwd=ROOT, env=env, capture_output=True, text=True)
+    if seeded.returncode:
+        sys.exit(f"Seeding failed:\n{seeded.stderr}")
+    snippet_id = seeded.stdout.split()[-1]
+
+    failed = False
+    for name, code in CHECKS:
+        result = subprocess.run([sys.executable, '-c', code.format(id=snippet_id)], cwd=ROOT, env=env,
+                                capture_output=True, text=True)
+        ok = result.returncode == 0
+        failed |= not ok
+        print(f"{'PASS' if ok else 'FAIL'}  {name}")
+        if not ok:
+            print('\n'.join('      ' + line for line in result.stderr.strip().splitlines()[-5:]))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
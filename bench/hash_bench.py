@@ -0,0 +1,90 @@
+"""Measure what each password hash setting costs per login.
+
+Usage:
+    python bench/hash_bench.py                        # default method ladder
+    python bench/hash_bench.py -c 4 -n 40 --methods scrypt:16384:8:1,scrypt:32768:8:1
+
+For each Werkzeug method string, verifies a stored hash -n times from -c
+client threads through the same concurrency cap the app uses
+(PASSWORD_HASH_CONCURRENCY = --pool). The report gives the single-hash
+latency, the p95 login wait under that load, and logins per second. Higher
+cost parameters raise the work an attacker needs per guess by the same
+factor they cut login throughput.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import HashingBusy, PasswordHasher  # noqa: E402
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:1000000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'scrypt:65536:8:1',
+]
+
+
+def bench(method, requests, concurrency, pool, timeout):
+    hasher = PasswordHasher()
+    hasher.configure(method, pool, timeout)
+    stored = hasher.hash('correct horse battery staple')
+    started = time.perf_counter()
+    hasher.verify(stored, 'correct horse battery staple')
+    single = time.perf_counter() - started
+
+    waits, busy = [], 0
+    lock = threading.Lock()
+    per_thread = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(count):
+        nonlocal busy
+        for _ in range(count):
+            t0 = time.perf_counter()
+            try:
+                hasher.verify(stored, 'correct horse battery staple')
+            except HashingBusy:
+                with lock:
+                    busy += 1
+                continue
+            with lock:
+                waits.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in per_thread]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    waits.sort()
+    p95 = waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else 0.0
+    return single, p95, len(waits) / wall if wall else 0.0, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--methods', default=','.join(DEFAULT_METHODS))
+    parser.add_argument('-n', '--requests', type=int, default=20, help='logins per method')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='concurrent login attempts')
+    parser.add_argument('--pool', type=int, default=2, help='PASSWORD_HASH_CONCURRENCY')
+    parser.add_argument('--timeout', type=float, default=30.0, help='PASSWORD_HASH_TIMEOUT')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, pool of {args.pool}, {args.concurrency} concurrent logins")
+    header = f"{'method':<24}{'hash ms':>9}{'p95 wait ms':>13}{'logins/s':>10}{'503s':>6}"
+    print(header)
+    print('-' * len(header))
+    for method in filter(None, (m.strip() for m in args.methods.split(','))):
+        single, p95, rate, busy = bench(method, args.requests, args.concurrency, args.pool, args.timeout)
+        print(f"{method:<24}{single * 1000:>9.1f}{p95 * 1000:>13.1f}{rate:>10.1f}{busy:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Check read-replica routing against two local SQLite databases.
+
+Usage:
+    python bench/replica_check.py
+
+A primary and a "replica" database are created in a temporary directory.
+The replica is refreshed from the primary with SQLite's backup API only when
+this script says so, which stands in for replication lag. The checks:
+
+  * anonymous read-only pages run every SELECT on the replica
+  * rows written to the primary since the last refresh are missing from
+    replica-served reads (so the routing really is in effect)
+  * a user's vote goes to the primary, and their next reads stay on the
+    primary (read-your-writes) until REPLICA_STICKY_SECONDS have passed
+  * routes not marked read-only always use the primary
+  * /metrics reports pool waits for both pool="primary" and pool="replica"
+
+Exits non-zero if any check fails.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STICKY_SECONDS = 1.0
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    primary_path, replica_path = os.path.join(workdir, 'primary.db'), os.path.join(workdir, 'replica.db')
+    os.environ['DATABASE_URL'] = f"sqlite:///{primary_path}"
+    os.environ['DATABASE_REPLICA_URLS'] = f"sqlite:///{replica_path}"
+    os.environ['REPLICA_STICKY_SECONDS'] = str(STICKY_SECONDS)
+    os.environ.setdefault('AUDIT_LOG_MODE', 'sync')
+    os.environ.setdefault('VOTE_COALESCE', '0')
+    os.environ.setdefault('JOBS_MODE', 'worker')  # no job thread polling the primary mid-check
+
+    from sqlalchemy import event
+    from app import app
+    from models import db, User, Snippet
+    import migrations
+
+    def replicate():
+        with sqlite3.connect(primary_path) as source, sqlite3.connect(replica_path) as target:
+            source.backup(target)
+
+    roles = Counter()
+    with app.app_context():
+        migrations.upgrade()
+        for key, engine in db.engines.items():
+            role = 'primary' if key is None else 'replica'
+            event.listen(engine, 'before_cursor_execute',
+                         lambda *args, role=role: roles.update([role]))
+        owner = User(username='replica-owner', password_hash='!')
+        voter = User(username='replica-voter', password_hash='!')
+        db.session.add_all([owner, voter])
+        db.session.flush()
+        first = Snippet(title='Replicated', content='print(1)', language='python', is_public=True, user_id=owner.id)
+        db.session.add(first)
+        db.session.commit()
+        first_id, voter_id = first.id, voter.id
+        replicate()
+        # Written after the last refresh: only the primary has it
+        lagging = Snippet(title='Not yet replicated', content='print(2)', language='python',
+                          is_public=True, user_id=owner.id)
+        db.session.add(lagging)
+        db.session.commit()
+        lagging_id = lagging.id
+
+    results = []
+
+    def check(name, ok, detail=''):
+        results.append(ok)
+        print(f"{'PASS' if ok else 'FAIL'}  {name}{f'  ({detail})' if detail else ''}")
+
+    def request(client, method, path, **kwargs):
+        roles.clear()
+        response = client.open(path, method=method, **kwargs)
+        return response, dict(roles)
+
+    anon = app.test_client()
+    response, used = request(anon, 'GET', '/')
+    check('anonymous feed reads from the replica', response.status_code == 200 and set(used) == {'replica'}, used)
+
+    response, used = request(anon, 'GET', '/api/v1/snippets?fields=id')
+    ids = {s['id'] for s in response.get_json()['snippets']}
+    check('replica-served reads lag the primary', first_id in ids and lagging_id not in ids, f"ids {sorted(ids)}")
+
+    member = app.test_client()
+    with member.session_transaction() as session:
+        session['_user_id'] = str(voter_id)
+        session['_fresh'] = True
+    response, used = request(member, 'POST', f'/vote/{first_id}/up', headers={'X-Requested-With': 'XMLHttpRequest'})
+    check('votes are written to the primary', response.status_code == 200 and set(used) == {'primary'}, used)
+
+    response, used = request(member, 'GET', f'/api/v1/me/votes?ids={first_id}')
+    vote = response.get_json()['votes'][str(first_id)]
+    check('the voter reads their own vote right away', vote == 1 and set(used) == {'primary'}, f"vote {vote}, {used}")
+
+    time.sleep(STICKY_SECONDS + 0.2)
+    response, used = request(member, 'GET', f'/api/v1/me/votes?ids={first_id}')
+    vote = response.get_json()['votes'][str(first_id)]
+    check('after the sticky window reads return to the replica', vote == 0 and set(used) == {'replica'},
+          f"vote {vote} (replica not refreshed yet), {used}")
+
+    replicate()
+    response, used = request(member, 'GET', f'/api/v1/me/votes?ids={first_id}')
+    check('the replica shows the vote once refreshed', response.get_json()['votes'][str(first_id)] == 1, used)
+
+    response, used = request(member, 'GET', '/settings')
+    check('routes not marked read-only use the primary', set(used) == {'primary'}, used)
+
+    with app.app_context():
+        metrics_text = app.test_client().get('/metrics').get_data(as_text=True)
+    check('pool waits are labelled by role',
+          'pool="primary"' in metrics_text and 'pool="replica"' in metrics_text)
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
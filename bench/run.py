@@ -0,0 +1,325 @@
+"""Drive the main routes and report latency, throughput and queries per request.
+
+Usage:
+    DATABASE_URL=sqlite:///bench.db python bench/run.py                          # Flask test client
+    DATABASE_URL=sqlite:///bench.db python bench/run.py --target gunicorn -c 8   # real server
+    python bench/run.py --save-baseline bench/baseline.json
+    python bench/run.py --baseline bench/baseline.json --fail-on-regression
+
+Seed the database first with bench/seed.py. Query counts come from the
+X-Query-Count header, so the app runs with METRICS_HEADERS=1. The test client
+target runs in-process and one request at a time; it measures the cost of
+the Python code. The gunicorn target adds real sockets, workers and
+concurrency.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['METRICS_HEADERS'] = '1'
+
+from seed import WORDS  # noqa: E402
+
+PASSWORD = 'password'
+ADMIN = 'user1'
+
+
+class Dataset:
+    # Ids and names sampled once from the seeded database
+    def __init__(self, sample=500, seed=0):
+        from app import app
+        from models import db, User, Snippet
+        rng = random.Random(seed)
+        with app.app_context():
+            self.snippet_ids = db.session.execute(
+                db.select(Snippet.id).where(Snippet.is_public.is_(True)).order_by(db.func.random()).limit(sample)
+            ).scalars().all()
+            self.usernames = db.session.execute(
+                db.select(User.username).where(User.snippet_count > 0).order_by(db.func.random()).limit(sample)
+            ).scalars().all()
+            self.member_count = db.session.execute(db.select(db.func.count(User.id))).scalar()
+            self.dialect = db.engine.dialect.name
+        if not self.snippet_ids or not self.usernames:
+            sys.exit("No data to benchmark; run bench/seed.py first.")
+        self.rng = rng
+
+    def member(self, n):
+        # A distinct non-admin login per worker thread, so votes never collide
+        return f"user{2 + n % max(self.member_count - 1, 1)}"
+
+
+# name -> (method, who, path builder); who is 'anon', 'member' or 'admin'
+SCENARIOS = {
+    'index': ('GET', 'anon', lambda d, rng: '/'),
+    'trending': ('GET', 'anon', lambda d, rng: '/?sort=trending'),
+    'top_week': ('GET', 'anon', lambda d, rng: '/?sort=top&window=week'),
+    'profile': ('GET', 'anon', lambda d, rng: f"/user/{rng.choice(d.usernames)}"),
+    'view_snippet': ('GET', 'anon', lambda d, rng: f"/snippet/{rng.choice(d.snippet_ids)}"),
+    'vote': ('POST', 'member', lambda d, rng: f"/vote/{rng.choice(d.snippet_ids)}/{rng.choice(['up', 'down'])}"),
+    'stats': ('GET', 'anon', lambda d, rng: '/stats'),
+    'search_users': ('GET', 'anon', lambda d, rng: f"/search?q={urllib.parse.quote(rng.choice(WORDS))}"),
+    'admin_dashboard': ('GET', 'admin', lambda d, rng: '/admin'),
+}
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+class TestClientTarget:
+    name = 'client'
+
+    def __init__(self, args):
+        from app import app
+        app.config['METRICS_HEADERS'] = True
+        self.app = app
+
+    def session(self, username=None):
+        client = self.app.test_client()
+        if username:
+            client.post('/login', data={'username': username, 'password': PASSWORD})
+
+        def send(method, path):
+            response = client.open(path, method=method, headers=AJAX)
+            response.get_data()
+            return response.status_code, int(response.headers.get('X-Query-Count', -1))
+        return send
+
+    def close(self):
+        pass
+
+
+class GunicornTarget:
+    name = 'gunicorn'
+
+    def __init__(self, args):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+        # Concurrency goes through the environment so gunicorn.conf.py sizes
+        # the connection pool to match
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app',
+               '--bind', f"127.0.0.1:{port}", '--log-level', 'warning']
+        env = dict(os.environ, METRICS_HEADERS='1', WEB_CONCURRENCY=str(args.workers),
+                   GUNICORN_THREADS=str(args.threads), GUNICORN_WORKER_CLASS=args.worker_class)
+        self.process = subprocess.Popen(cmd, cwd=ROOT, env=env)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(f"{self.base}/health", timeout=2).read()
+                return
+            except OSError:
+                if self.process.poll() is not None:
+                    sys.exit("gunicorn exited during startup")
+                time.sleep(0.2)
+        self.close()
+        sys.exit("gunicorn did not become healthy within 60s")
+
+    def session(self, username=None):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        if username:
+            body = urllib.parse.urlencode({'username': username, 'password': PASSWORD}).encode()
+            opener.open(f"{self.base}/login", data=body).read()
+
+        def send(method, path):
+            request = urllib.request.Request(self.base + path, method=method, headers=AJAX,
+                                             data=b'' if method == 'POST' else None)
+            try:
+                with opener.open(request) as response:
+                    response.read()
+                    return response.status, int(response.headers.get('X-Query-Count', -1))
+            except urllib.error.HTTPError as exc:
+                exc.read()
+                return exc.code, int(exc.headers.get('X-Query-Count', -1))
+        return send
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run_scenario(target, dataset, name, requests, concurrency, warmup, seed):
+    method, who, build = SCENARIOS[name]
+    latencies, queries, errors = [], [], 0
+    lock = threading.Lock()
+    per_thread = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(n):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + n)
+        username = ADMIN if who == 'admin' else dataset.member(n) if who == 'member' else None
+        send = target.session(username)
+        for _ in range(warmup):
+            send(method, build(dataset, rng))
+        barrier.wait()
+        local_latencies, local_queries, local_errors = [], [], 0
+        for _ in range(per_thread[n]):
+            path = build(dataset, rng)
+            started = time.perf_counter()
+            status, count = send(method, path)
+            local_latencies.append(time.perf_counter() - started)
+            local_queries.append(count)
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors += local_errors
+
+    barrier = threading.Barrier(concurrency + 1)
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    counted = [q for q in queries if q >= 0]
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries': round(sum(counted) / len(counted), 2) if counted else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    header = f"{'scenario':<16}{'reqs':>7}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results['scenarios'].items():
+        queries = '-' if r['queries'] is None else f"{r['queries']:g}"
+        print(f"{name:<16}{r['requests']:>7}{r['errors']:>5}{r['throughput']:>9.1f}"
+              f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{queries:>9}")
+        old = (baseline or {}).get('scenarios', {}).get(name)
+        if old:
+            deltas = []
+            for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if old[key]:
+                    deltas.append(f"{key} {100 * (r[key] - old[key]) / old[key]:+.0f}%")
+            if old.get('queries') is not None and r['queries'] is not None:
+                deltas.append(f"queries {r['queries'] - old['queries']:+g}")
+            print(f"{'':<16}vs baseline: {', '.join(deltas)}")
+
+
+def regressions(results, baseline, tolerance):
+    # p95 slower than tolerance allows, or more queries than before
+    found = []
+    for name, r in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            continue
+        if old['p95_ms'] and r['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            found.append(f"{name}: p95 {old['p95_ms']}ms -> {r['p95_ms']}ms")
+        if old.get('queries') is not None and r['queries'] is not None and r['queries'] > old['queries']:
+            found.append(f"{name}: queries {old['queries']} -> {r['queries']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset')
+    parser.add_argument('-n', '--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='client threads (gunicorn target only)')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per thread')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers (more need CACHE_BACKEND=redis)')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--worker-class', default='gthread', help='gunicorn worker class')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--save-baseline', metavar='PATH', help='store these results as the baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed p95 slowdown (0.15 = 15%%)')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    dataset = Dataset(seed=args.seed)
+    if args.target == 'client':
+        # The test client shares one app and session; keep it single threaded
+        target, concurrency = TestClientTarget(args), 1
+    else:
+        target, concurrency = GunicornTarget(args), args.concurrency
+
+    results = {
+        'meta': {
+            'target': target.name, 'concurrency': concurrency, 'dialect': dataset.dialect,
+            'workers': args.workers if target.name == 'gunicorn' else None,
+            'threads': args.threads if target.name == 'gunicorn' else None,
+            'revision': git_revision(), 'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in names:
+            print(f"running {name}...", file=sys.stderr)
+            results['scenarios'][name] = run_scenario(
+                target, dataset, name, args.requests, concurrency, args.warmup, args.seed
+            )
+    finally:
+        target.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline['meta'].get('target') != target.name:
+            print(f"warning: baseline was recorded with --target {baseline['meta'].get('target')}", file=sys.stderr)
+    print_report(results, baseline)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as fh:
+            json.dump(results, fh, indent=2)
+            fh.write('\n')
+
+    if baseline:
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Generate a realistic benchmark dataset.
+
+Usage:
+    DATABASE_URL=sqlite:///bench.db python bench/seed.py --users 10000 --snippets 500000 --votes 5000000
+
+Users are named user1..userN with password "password" (user1 is the admin).
+Snippet ownership and vote popularity both follow a Zipf distribution, so a
+few users and snippets dominate, as on the real site. The target database
+must be empty (or pass --reset to drop and recreate every table).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+LANGUAGES = ['python', 'javascript', 'css', 'html', 'lua', 'markdown']
+COUNTRIES = ['USA', 'Canada', 'UK', 'Germany', 'France', 'India', 'Japan', 'Australia', 'Brazil', 'China', 'Unknown']
+WORDS = ['cache', 'parser', 'quicksort', 'router', 'debounce', 'fetch', 'matrix', 'token', 'stream', 'vector',
+         'retry', 'buffer', 'graph', 'hash', 'queue', 'render', 'shader', 'socket', 'widget', 'lexer']
+LINES = {
+    'python': ['def {w}(items):', '    return [x for x in items if x]', 'import {w}', 'for i in range(10):',
+               '    print(i, "{w}")', 'class {W}:', '    pass'],
+    'javascript': ['function {w}(a, b) {{', '  return a + b;', '}}', 'const {w} = () => null;',
+                   'export default {w};', 'let x = [1, 2, 3].map(n => n * 2);'],
+    'css': ['.{w} {{', '  display: flex;', '  color: #fff;', '}}', '@media (max-width: 600px) {{ .{w} {{ gap: 0; }} }}'],
+    'html': ['<div class="{w}">', '  <span>{w}</span>', '</div>', '<a href="#{w}">link</a>'],
+    'lua': ['local function {w}(t)', '  return #t', 'end', 'for i = 1, 10 do print(i) end'],
+    'markdown': ['# {W}', '- item', '`{w}()` returns nothing', '> quote about {w}'],
+}
+
+
+def zipf_weights(n, s):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def allocate(total, weights, cap):
+    # Split `total` proportionally to `weights`, capping each share at `cap`
+    # and handing the excess to the uncapped entries (water-filling)
+    counts = [0] * len(weights)
+    open_idx = list(range(len(weights)))
+    remaining = total
+    for _ in range(8):
+        if remaining <= 0 or not open_idx:
+            break
+        weight_sum = sum(weights[i] for i in open_idx)
+        still_open = []
+        handed_out = 0
+        for i in open_idx:
+            share = int(remaining * weights[i] / weight_sum)
+            take = min(share, cap - counts[i])
+            counts[i] += take
+            handed_out += take
+            if counts[i] < cap:
+                still_open.append(i)
+        remaining -= handed_out
+        open_idx = still_open
+        if handed_out == 0:
+            break
+    return counts
+
+
+def snippet_body(rng, language):
+    word = rng.choice(WORDS)
+    lines = [rng.choice(LINES[language]).format(w=word, W=word.capitalize()) for _ in range(rng.randint(3, 60))]
+    return '\n'.join(lines)
+
+
+def insert_batches(conn, table, rows_iter, batch_size, label):
+    batch, total, started = [], 0, time.perf_counter()
+    for row in rows_iter:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.execute(table.insert(), batch)
+            total += len(batch)
+            batch = []
+            print(f"\r  {label}: {total:,}", end='', flush=True)
+    if batch:
+        conn.execute(table.insert(), batch)
+        total += len(batch)
+    print(f"\r  {label}: {total:,} in {time.perf_counter() - started:.1f}s")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--snippets', type=int, default=500000)
+    parser.add_argument('--votes', type=int, default=5000000)
+    parser.add_argument('--logs', type=int, default=100000, help='admin log rows')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for popularity')
+    parser.add_argument('--public', type=float, default=0.8, help='fraction of public snippets')
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    args = parser.parse_args()
+
+    # Seeding writes its own audit rows; keep the app from spawning a writer
+    os.environ.setdefault('AUDIT_LOG_MODE', 'sync')
+    from app import app
+    from models import db, User, Snippet, Vote, AdminLog
+    import migrations
+    import ranking
+    import search
+    import stats as site_stats
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    with app.app_context():
+        if args.reset:
+            search.drop_index()
+            db.drop_all()
+            migrations.schema_version.drop(db.engine, checkfirst=True)
+        migrations.upgrade()
+        if db.session.query(User.id).first() is not None:
+            sys.exit("Database is not empty; pass --reset to wipe it.")
+        print(f"Seeding {db.engine.url.render_as_string(hide_password=True)}")
+        conn = db.session.connection()
+
+        password_hash = generate_password_hash('password')
+        insert_batches(conn, User.__table__, (
+            {'id': i, 'username': f"user{i}", 'password_hash': password_hash,
+             'country': rng.choice(COUNTRIES), 'is_moderator': i % 500 == 0}
+            for i in range(1, args.users + 1)
+        ), args.batch, 'users')
+
+        owner_cum = []
+        acc = 0.0
+        for w in zipf_weights(args.users, args.skew):
+            acc += w
+            owner_cum.append(acc)
+        owners = rng.choices(range(1, args.users + 1), cum_weights=owner_cum, k=args.snippets)
+
+        def snippet_rows():
+            for i in range(1, args.snippets + 1):
+                language = rng.choice(LANGUAGES)
+                yield {
+                    'id': i, 'title': f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} #{i}",
+                    'content': snippet_body(rng, language), 'language': language,
+                    'is_public': rng.random() < args.public, 'user_id': owners[i - 1],
+                    'created_at': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+                }
+        insert_batches(conn, Snippet.__table__, snippet_rows(), args.batch, 'snippets')
+
+        # Popular snippets get more voters; each voter votes at most once
+        popularity = list(range(1, args.snippets + 1))
+        rng.shuffle(popularity)
+        per_snippet = allocate(args.votes, zipf_weights(args.snippets, args.skew), args.users)
+
+        def vote_rows():
+            for snippet_id, count in zip(popularity, per_snippet):
+                for user_id in rng.sample(range(1, args.users + 1), count):
+                    yield {'user_id': user_id, 'snippet_id': snippet_id, 'value': 1 if rng.random() < 0.8 else -1}
+        insert_batches(conn, Vote.__table__, vote_rows(), args.batch, 'votes')
+
+        actions = ['Login', 'Logout', 'Create Snippet', 'Edit Snippet', 'Toggle Privacy']
+        insert_batches(conn, AdminLog.__table__, (
+            {'admin_id': rng.randint(1, args.users), 'action': rng.choice(actions), 'details': 'seeded',
+             'timestamp': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))}
+            for _ in range(args.logs)
+        ), args.batch, 'logs')
+
+        if db.engine.dialect.name == 'postgresql':
+            # Explicit ids bypass the sequences; move them past the seeded rows
+            for table in ('user', 'snippet'):
+                db.session.execute(db.text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), (SELECT MAX(id) FROM \"{table}\"))"
+                ))
+        db.session.commit()
+
+        # Bodies were bulk-inserted into the legacy column; move them to blobs
+        print("  moving snippet bodies into blobs...")
+        Snippet.backfill_blobs(args.batch)
+        print("  rebuilding counters, leaderboards, rankings and search index...")
+        site_stats.rebuild()
+        ranking.rebuild()
+        search.rebuild()
+    print("✅ Done.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Compare gunicorn serving modes under simulated database latency.
+
+Usage:
+    python bench/serving_bench.py                                  # temporary seeded SQLite
+    DATABASE_URL=sqlite:///bench.db python bench/serving_bench.py --latency-ms 20 -c 32
+    python bench/serving_bench.py --modes sync,gthread,gevent --duration 20
+
+Each mode runs the real app under gunicorn with the same number of worker
+processes:
+  * sync     the previous setup: `gunicorn app:app` with sync workers and
+             no config file
+  * gthread  gunicorn.conf.py as deployed, with GUNICORN_THREADS threads
+  * gevent   gunicorn.conf.py with gevent workers (needs gevent installed)
+Every SQL statement sleeps for --latency-ms first, which mimics the round
+trip to a remote Postgres that dominates request time in production. The
+sleep releases the GIL, and under gevent it yields, as a real database wait
+would. Client threads then hit a mix of anonymous pages and API reads for
+--duration seconds. The script reports requests per second and latency for
+each mode, relative to sync.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+
+PATHS = ['/', '/?sort=trending', '/api/v1/snippets', '/api/v1/snippets?sort=top&window=week', '/stats']
+MODES = ('sync', 'gthread', 'gevent')
+
+
+def create_app():
+    # WSGI entry point for the servers under test: the real app, with every
+    # SQL statement delayed by BENCH_DB_LATENCY_MS
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import app
+    delay = float(os.environ.get('BENCH_DB_LATENCY_MS', 0)) / 1000
+    if delay:
+        event.listen(Engine, 'before_cursor_execute', lambda *args: time.sleep(delay))
+    return app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, args, port, empty_config):
+    env = dict(os.environ, BENCH_DB_LATENCY_MS=str(args.latency_ms), WEB_CONCURRENCY=str(args.workers),
+               PYTHONPATH=os.pathsep.join(filter(None, [BENCH, ROOT, os.environ.get('PYTHONPATH')])))
+    # Sync is the app as it was served before gunicorn.conf.py; an empty
+    # config stops gunicorn from picking that file up from the working directory
+    if mode == 'sync':
+        config = ['-c', empty_config, '--workers', str(args.workers), '--worker-class', 'sync']
+    else:
+        config = ['-c', 'gunicorn.conf.py']
+        env.update(GUNICORN_WORKER_CLASS=mode, GUNICORN_THREADS=str(args.threads),
+                   GUNICORN_WORKER_CONNECTIONS=str(args.connections))
+    cmd = [sys.executable, '-m', 'gunicorn', *config, 'serving_bench:create_app()',
+           '--bind', f"127.0.0.1:{port}", '--log-level', 'warning']
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/health')
+            conn.getresponse().read()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                sys.exit(f"gunicorn ({mode}) exited during startup")
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f"gunicorn ({mode}) did not become healthy within 60s")
+
+
+def drive(port, concurrency, duration):
+    # Keep-alive clients (sync workers close every connection, and
+    # http.client reconnects); returns (latencies, errors)
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(n):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine, failed, i = [], 0, n
+        while time.monotonic() < stop_at:
+            path = PATHS[i % len(PATHS)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct), len(ordered) - 1)] if ordered else float('nan')
+
+
+def seed_database():
+    path = os.path.join(tempfile.mkdtemp(), 'serving.db')
+    os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+    print(f"Seeding a temporary database at {path}...")
+    subprocess.run([sys.executable, os.path.join(BENCH, 'seed.py'), '--users', '500', '--snippets', '5000',
+                    '--votes', '20000'], check=True, cwd=ROOT, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,gthread', help=f"comma separated subset of {','.join(MODES)}")
+    parser.add_argument('--latency-ms', type=float, default=10, help='simulated delay per SQL statement')
+    parser.add_argument('-c', '--concurrency', type=int, default=32, help='client threads')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per mode')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds per mode')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers in every mode (more need CACHE_BACKEND=redis)')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    parser.add_argument('--connections', type=int, default=100, help='greenlets per gevent worker')
+    args = parser.parse_args()
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        sys.exit(f"Unknown mode(s): {', '.join(unknown)}")
+
+    if not os.environ.get('DATABASE_URL'):
+        seed_database()
+    os.environ.setdefault('AUDIT_LOG_MODE', 'sync')
+    os.environ.setdefault('JOBS_MODE', 'worker')  # no job thread polling the database
+    os.environ.setdefault('SLOW_REQUEST_MS', '60000')
+    os.environ.setdefault('SLOW_QUERY_COUNT', '1000')
+
+    empty_config = os.path.join(tempfile.mkdtemp(), 'empty.conf.py')
+    open(empty_config, 'w').close()
+    print(f"{args.workers} workers, {args.concurrency} clients, {args.latency_ms:g}ms per statement, "
+          f"{args.duration:g}s per mode\n")
+    print(f"{'mode':<9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'vs sync':>8}")
+    baseline = None
+    for mode in modes:
+        port = free_port()
+        process = start_server(mode, args, port, empty_config)
+        try:
+            drive(port, args.concurrency, args.warmup)
+            latencies, errors = drive(port, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait(30)
+        rps = len(latencies) / args.duration
+        if mode == 'sync':
+            baseline = rps
+        relative = f"{rps / baseline:.1f}x" if baseline else '-'
+        print(f"{mode:<9} {rps:>8.1f} {percentile(latencies, 0.5) * 1000:>8.1f} "
+              f"{percentile(latencies, 0.95) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+              f"{errors:>7} {relative:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Hammer one snippet with concurrent votes and check the counters add up.
+
+Usage:
+    python bench/vote_hammer.py                                   # temporary SQLite file
+    DATABASE_URL=postgresql://localhost/codesnap python bench/vote_hammer.py --threads 32
+    python bench/vote_hammer.py --coalesce                        # VOTE_COALESCE mode
+
+Each thread is logged in as one of --users voters (several threads share a
+voter, to reproduce double clicks) and fires --votes random up/down votes at
+the same snippet. Afterwards the snippet's score, upvotes and downvotes must
+equal what the vote rows say, its hot score must match that score, and the
+owner's reputation must equal the sum of their snippet scores. Exits non-zero on any mismatch or failed request.
+A 409 is not a failure: it tells the client a concurrent click cast the same
+vote first, and changes nothing.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--users', type=int, default=8, help='distinct voters (fewer than threads = shared)')
+    parser.add_argument('--votes', type=int, default=50, help='votes per thread')
+    parser.add_argument('--coalesce', action='store_true', help='run with VOTE_COALESCE=1')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/hammer.db"
+    os.environ['VOTE_COALESCE'] = '1' if args.coalesce else '0'
+    os.environ.setdefault('AUDIT_LOG_MODE', 'sync')
+    # Pool waits are the point of the exercise; keep the slow-request log quiet
+    os.environ.setdefault('SLOW_REQUEST_MS', '60000')
+    os.environ.setdefault('SLOW_QUERY_COUNT', '1000')
+
+    from app import app
+    from models import db, User, Snippet, Vote
+    from votes import coalescer
+    import migrations
+    import ranking
+
+    with app.app_context():
+        migrations.upgrade()
+        names = ['hammer-owner'] + [f"hammer{i}" for i in range(args.users)]
+        existing = set(db.session.execute(db.select(User.username).where(User.username.in_(names))).scalars())
+        db.session.add_all(User(username=name, password_hash='!') for name in names if name not in existing)
+        db.session.commit()
+        ids = dict(db.session.execute(db.select(User.username, User.id).where(User.username.in_(names))).all())
+        snippet = Snippet(title='Hammer target', content='pass', language='python', is_public=True,
+                          user_id=ids['hammer-owner'])
+        db.session.add(snippet)
+        User.adjust_totals(snippet.user_id, snippets=1)
+        db.session.commit()
+        snippet_id, owner_id = snippet.id, snippet.user_id
+
+    statuses = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker(n):
+        rng = random.Random(args.seed * 1000 + n)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(ids[f"hammer{n % args.users}"])
+            session['_fresh'] = True
+        barrier.wait()
+        local = Counter()
+        for _ in range(args.votes):
+            response = client.post(f"/vote/{snippet_id}/{rng.choice(['up', 'down'])}",
+                                   headers={'X-Requested-With': 'XMLHttpRequest'})
+            local[response.status_code] += 1
+        with lock:
+            statuses.update(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    coalescer.flush()
+
+    with app.app_context():
+        snippet = db.session.get(Snippet, snippet_id)
+        values = Counter(db.session.execute(db.select(Vote.value).where(Vote.snippet_id == snippet_id)).scalars())
+        expected = (values[1] - values[-1], values[1], values[-1])
+        actual = (snippet.score, snippet.upvotes, snippet.downvotes)
+        hot_ok = abs(snippet.hot_score - ranking.hot(snippet.score, snippet.created_at)) < 1e-6
+        reputation = db.session.get(User, owner_id).reputation
+        owner_score = db.session.execute(
+            db.select(db.func.coalesce(db.func.sum(Snippet.score), 0)).where(Snippet.user_id == owner_id)
+        ).scalar()
+        dialect = db.engine.dialect.name
+
+    total = sum(statuses.values())
+    print(f"{dialect}: "
+          f"{total} votes from {args.threads} threads as {args.users} voters in {elapsed:.2f}s "
+          f"({total / elapsed:.0f}/s){' [coalesced]' if args.coalesce else ''}")
+    print(f"  responses        {dict(statuses)}")
+    print(f"  score/up/down    {actual}   from vote rows {expected}")
+    print(f"  hot score        {'matches score' if hot_ok else 'STALE'}")
+    print(f"  owner reputation {reputation}   sum of snippet scores {owner_score}")
+    ok = statuses.keys() <= {200, 409} and actual == expected and hot_ok and reputation == owner_score
+    print('PASS' if ok else 'FAIL')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+# Encoding of snippet bodies for the content-addressed SnippetBlob table.
+#
+# A body is keyed by the SHA-256 of its UTF-8 text, so every copy of the
+# same snippet, from any user, shares one row. Bodies of at least
+# BLOB_COMPRESS_MIN_BYTES are compressed with BLOB_COMPRESSION ('zlib', or
+# 'zstd' with the `zstandard` package installed; 'none' stores them as-is).
+# Each blob records its own encoding, so changing the setting only affects
+# new blobs. Every worker reading zstd blobs needs `zstandard` installed.
+
+ENCODINGS = ('plain', 'zlib', 'zstd')
+
+
+class BlobCodec:
+    def __init__(self):
+        self.compression = 'zlib'
+        self.min_bytes = 256
+        self.level = 6
+
+    def init_app(self, app):
+        app.config.setdefault('BLOB_COMPRESSION', os.environ.get('BLOB_COMPRESSION', 'zlib'))
+        app.config.setdefault('BLOB_COMPRESS_MIN_BYTES', int(os.environ.get('BLOB_COMPRESS_MIN_BYTES', 256)))
+        compression = app.config['BLOB_COMPRESSION']
+        if compression == 'zstd' and zstandard is None:
+            app.logger.warning('BLOB_COMPRESSION=zstd but the zstandard package is missing; using zlib')
+            compression = 'zlib'
+        self.compression = compression if compression in ('zlib', 'zstd') else 'plain'
+        self.min_bytes = app.config['BLOB_COMPRESS_MIN_BYTES']
+
+    @staticmethod
+    def digest(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def encode(self, text):
+        # Returns (encoding, data)
+        raw = text.encode('utf-8')
+        if len(raw) < self.min_bytes or self.compression == 'plain':
+            return 'plain', raw
+        if self.compression == 'zstd':
+            data = zstandard.ZstdCompressor(level=self.level).compress(raw)
+        else:
+            data = zlib.compress(raw, self.level)
+        # Short or incompressible bodies can come out larger
+        return (self.compression, data) if len(data) < len(raw) else ('plain', raw)
+
+    @staticmethod
+    def decode(encoding, data):
+        data = bytes(data)
+        if encoding == 'zlib':
+            data = zlib.decompress(data)
+        elif encoding == 'zstd':
+            if zstandard is None:
+                raise RuntimeError('This snippet is zstd-compressed; install the zstandard package to read it')
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return data.decode('utf-8')
+
+
+codec = BlobCodec()
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, session, make_response, render_template
+from flask_login import current_user
+from markupsafe import Markup
+
+# Shared cache layer for HTTP validators and rendered fragments.
+#
+# Every cacheable thing is described by version keys ('feed', 'snippet:12',
+# 'profile:alice', 'stats', and 'site' for changes that touch everything).
+# A key's version is the time it last changed. Write paths call touch();
+# readers combine the versions into an ETag / Last-Modified or a fragment
+# key. Nothing is ever deleted by hand: bumping a version orphans stale
+# entries, which then age out.
+#
+# CACHE_BACKEND = 'memory' (default, per process) or 'redis' (shared across
+# gunicorn workers; needs the `redis` package and CACHE_REDIS_URL).
+
+FRAGMENT_TTL = 3600
+
+
+class MemoryBackend:
+    def __init__(self, maxsize=10000, max_stamps=50000):
+        self.maxsize = maxsize
+        self.max_stamps = max_stamps
+        # Both least recently used first. Fragments and other entries with a
+        # TTL live in `data`; version stamps (set without one) in `stamps`.
+        self.data = OrderedDict()
+        self.stamps = OrderedDict()
+        self.lock = threading.Lock()
+        # Versions that were never touched in this process date from boot,
+        # so a restart can never validate a page rendered before it
+        self.started = time.time()
+        # Newest stamp evicted so far. A key missing from `stamps` may have
+        # been evicted, so it reads as at least this: an eviction can cost a
+        # revalidation, never produce a false 304.
+        self.evicted_up_to = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.stamps:
+                self.stamps.move_to_end(key)
+                return self.stamps[key]
+            item = self.data.get(key)
+            if item is None:
+                return None
+            if item[1] and item[1] < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return item[0]
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            if ttl:
+                self.data[key] = (value, time.monotonic() + ttl)
+                self.data.move_to_end(key)
+                if len(self.data) > self.maxsize:
+                    self.data.popitem(last=False)
+            else:
+                self.stamps[key] = value
+                self.stamps.move_to_end(key)
+                if len(self.stamps) > self.max_stamps:
+                    _, evicted = self.stamps.popitem(last=False)
+                    self.evicted_up_to = max(self.evicted_up_to, float(evicted))
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.stamps.pop(key, None)
+
+    def version_default(self, key):
+        return max(self.started, self.evicted_up_to)
+
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis  # optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def get_many(self, keys):
+        return [v.decode('utf-8') if v is not None else None for v in self.client.mget(keys)] if keys else []
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def version_default(self, key):
+        # First sight of a key: record "now" so every worker agrees on it
+        now = time.time()
+        self.client.set(key, now, nx=True)
+        return float(self.client.get(key))
+
+
+backend = MemoryBackend()
+
+
+def init_app(app):
+    global backend
+    app.config.setdefault('CACHE_BACKEND', os.environ.get('CACHE_BACKEND', 'memory'))
+    app.config.setdefault('CACHE_REDIS_URL', os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+    if app.config['CACHE_BACKEND'] == 'redis':
+        backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+    app.add_template_global(render_card)
+
+
+def touch(*keys):
+    # Mark content as changed; call after the write commits
+    now = time.time()
+    for key in keys:
+        backend.set(f"v:{key}", now)
+
+
+def snippet_changed(snippet_id, owner_name):
+    # Expire cached pages and cards that show this snippet (after commit)
+    touch('feed', f'snippet:{snippet_id}', f'profile:{owner_name}', 'stats')
+
+
+def versions(*keys):
+    values = backend.get_many([f"v:{key}" for key in keys])
+    return [float(v) if v is not None else float(backend.version_default(f"v:{key}"))
+            for key, v in zip(keys, values)]
+
+
+def conditional(*key_funcs, clock=None):
+    # Conditional GET for anonymous page views. Each key_func receives the
+    # view kwargs and returns a version key. `clock`, if given, returns an
+    # extra timestamp for pages that also change with time alone. Matching
+    # If-None-Match or If-Modified-Since answers 304 without running the view.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_user.is_authenticated or session.get('_flashes'):
+                return view(*args, **kwargs)
+            stamps = versions('site', *(func(**kwargs) for func in key_funcs))
+            if clock is not None:
+                stamps.append(clock())
+            etag = hashlib.sha1(repr((request.full_path, stamps)).encode()).hexdigest()
+            last_modified = datetime.fromtimestamp(int(max(stamps)), tz=timezone.utc)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            response = make_response('', 304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'no-cache'
+                response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+def _viewer_role(snippet):
+    # Cards differ only by which owner/staff controls they show
+    if not current_user.is_authenticated:
+        return 'anon'
+    role = 'owner' if current_user.id == snippet.user_id else 'member'
+    if current_user.id == 1 or current_user.is_moderator:
+        role += '-staff'
+    return role
+
+
+def render_card(template_name, snippet):
+    # Render one snippet card through the fragment cache
+    site_version, snippet_version = versions('site', f"snippet:{snippet.id}")
+    key = f"frag:{template_name}:{request.host}:{snippet.id}:{snippet_version}:{site_version}:{_viewer_role(snippet)}"
+    html = backend.get(key)
+    if html is None:
+        html = render_template(template_name, snippet=snippet)
+        backend.set(key, html, ttl=FRAGMENT_TTL)
+    return Markup(html)
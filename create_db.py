@@ -1,5 +1,6 @@
-from app import app, db
+from app import app
+import migrations
 
 with app.app_context():
-    db.create_all()
+    migrations.upgrade()
     print("Database tables created.")
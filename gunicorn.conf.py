@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+
+# Production gunicorn settings. Gunicorn loads this file from the working
+# directory by itself. render.yaml also passes it explicitly:
+#     python migrate.py && gunicorn -c gunicorn.conf.py app:app
+#
+# GUNICORN_WORKER_CLASS picks the concurrency model for each of the
+# WEB_CONCURRENCY worker processes:
+#   gthread  (default) GUNICORN_THREADS request threads. Requests spend most
+#            of their time waiting on database round trips, and Python
+#            releases the GIL while they wait. So one process serves
+#            several requests at once where a sync worker sat idle.
+#   gevent   GUNICORN_WORKER_CONNECTIONS greenlets. Needs the gevent
+#            package, plus psycogreen for Postgres: without it every query
+#            blocks the whole worker.
+#   sync     one request at a time per process, as before.
+# Set these through the environment rather than --threads and friends: the
+# pool sizing below reads them before the app is imported.
+#
+# The app is preloaded. The master imports it once, import errors surface
+# before any worker starts, and the forked workers share its memory. Nothing
+# connects to the database at import time, and post_fork discards any pooled
+# connection a worker inherits, so no two processes ever share a socket.
+# Background threads (audit writer, vote coalescer, job worker) start
+# lazily in each worker.
+#
+# More than one worker needs CACHE_BACKEND=redis. The default memory cache
+# keeps its version stamps and fragments in each process, so a write seen
+# by one worker would leave the others answering 304s and serving cached
+# cards for the old content. With the memory backend the default is one
+# worker, which gets its concurrency from threads, and asking for more is
+# refused at startup.
+
+cache_backend = os.environ.get('CACHE_BACKEND', 'memory')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 if cache_backend == 'redis' else 1))
+if workers > 1 and cache_backend == 'memory':
+    sys.exit(f"gunicorn.conf.py: WEB_CONCURRENCY={workers} needs CACHE_BACKEND=redis; the memory "
+             f"cache is per process and workers would serve each other's stale pages")
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+keepalive = 5  # behind a load balancer that reuses connections
+
+# One pooled connection per request that can run at once (at least the
+# app's default of 5), plus overflow for the background threads, so
+# requests do not queue for a connection. Applies per engine (replicas too,
+# unless DB_REPLICA_* says otherwise) and per worker, so the database sees
+# up to workers x (pool + overflow) connections per engine. Greenlets are
+# capped at GUNICORN_DB_POOL_MAX; the rest wait up to DB_POOL_TIMEOUT for a
+# connection instead of exhausting the server.
+if worker_class == 'gthread':
+    concurrency = threads
+elif worker_class == 'gevent':
+    concurrency = min(worker_connections, int(os.environ.get('GUNICORN_DB_POOL_MAX', 20)))
+else:
+    concurrency = 1
+os.environ.setdefault('DB_POOL_SIZE', str(max(concurrency, 5)))
+os.environ.setdefault('DB_MAX_OVERFLOW', '2')
+
+if worker_class == 'gevent':
+    # Patch before the app is imported, so the locks and sockets it creates
+    # at import time cooperate with greenlets
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        print('gunicorn.conf.py: psycogreen is not installed; Postgres queries will block gevent workers',
+              file=sys.stderr)
+
+
+def post_fork(server, worker):
+    # Discard (without closing: the master still owns them) any connections
+    # inherited from the master; the worker opens its own on first use
+    web = sys.modules.get('app')
+    if web is None:  # not preloaded: the worker has not imported the app yet
+        return
+    import cache
+    from models import db
+    if isinstance(cache.backend, cache.MemoryBackend):
+        # A replacement worker starts with no stamps; date them from its own
+        # start, not the master's, so it never validates an ETag issued
+        # before it existed
+        cache.backend.started = time.time()
+    with web.app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
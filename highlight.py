@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import pygments
+from markupsafe import Markup
+from pygments import highlight as pygments_highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.lexers.special import TextLexer
+from pygments.util import ClassNotFound
+
+# Server-side syntax highlighting. Rendered HTML is cached under a hash of
+# (content, language, highlighter version), so editing a snippet simply
+# produces a new key and stale entries age out of the LRU; nothing has to be
+# invalidated by hand. With HIGHLIGHT_CACHE_DIR set, renders also persist on
+# disk and survive restarts (and are shared by workers on the same host).
+# The directory is capped at HIGHLIGHT_CACHE_DIR_ENTRIES files: once a write
+# takes it past that, the least recently used tenth is deleted (disk hits
+# refresh a file's mtime).
+
+# Bump when the markup we emit changes, to orphan every cached render
+HIGHLIGHTER_VERSION = f"{pygments.__version__}-1"
+
+PREVIEW_LINES = 12
+PREVIEW_CHARS = 1500
+
+_formatter = HtmlFormatter(nowrap=True)
+
+
+class RenderCache:
+    def __init__(self, maxsize=1024, directory=None, max_files=50000):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_files = max_files
+        self.files = None  # files in the directory as of the last scan, plus our writes since
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()  # keeps scans off the in-memory lookups
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.directory:
+            path = os.path.join(self.directory, f"{key}.html")
+            try:
+                with open(path, encoding='utf-8') as fh:
+                    html = fh.read()
+                os.utime(path)
+            except OSError:
+                return None
+            self._remember(key, html)
+            return html
+        return None
+
+    def set(self, key, html):
+        self._remember(key, html)
+        if self.directory:
+            # Write-then-rename so concurrent readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+                fh.write(html)
+            os.replace(tmp_path, os.path.join(self.directory, f"{key}.html"))
+            self._count_file()
+
+    def _count_file(self):
+        # Another worker may have pruned (or written) since our last scan,
+        # so the count is only a trigger; _prune rescans before deleting
+        with self.disk_lock:
+            if self.files is None:
+                self.files = len(self._scan())  # includes the file just written
+            else:
+                self.files += 1
+            if self.files > self.max_files:
+                self.files = self._prune()
+
+    def _scan(self):
+        # [(mtime, path)] for every cached render in the directory
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.html'):
+                    try:
+                        found.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass  # removed by another worker meanwhile
+        return found
+
+    def _prune(self):
+        # Delete the least recently used files down to 90% of max_files;
+        # returns how many are left
+        found = sorted(self._scan())
+        excess = len(found) - self.max_files * 9 // 10
+        for _, path in found[:max(excess, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(found) - max(excess, 0)
+
+    def _remember(self, key, html):
+        with self.lock:
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+cache = RenderCache()
+
+
+def init_app(app):
+    app.config.setdefault('HIGHLIGHT_CACHE_SIZE', int(os.environ.get('HIGHLIGHT_CACHE_SIZE', 1024)))
+    app.config.setdefault('HIGHLIGHT_CACHE_DIR', os.environ.get('HIGHLIGHT_CACHE_DIR'))
+    app.config.setdefault('HIGHLIGHT_CACHE_DIR_ENTRIES', int(os.environ.get('HIGHLIGHT_CACHE_DIR_ENTRIES', 50000)))
+    cache.maxsize = app.config['HIGHLIGHT_CACHE_SIZE']
+    cache.directory = app.config['HIGHLIGHT_CACHE_DIR']
+    cache.max_files = app.config['HIGHLIGHT_CACHE_DIR_ENTRIES']
+    if cache.directory:
+        os.makedirs(cache.directory, exist_ok=True)
+    app.add_template_filter(highlight, 'highlight')
+    app.add_template_filter(highlight_preview, 'highlight_preview')
+    app.add_template_filter(snippet_preview, 'snippet_preview')
+
+
+def cache_key(content, language):
+    digest = hashlib.sha256()
+    for part in (HIGHLIGHTER_VERSION, language or '', content or ''):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _lexer(language):
+    try:
+        return get_lexer_by_name(language or 'text', stripnl=False)
+    except ClassNotFound:
+        return TextLexer(stripnl=False)
+
+
+def highlight(content, language):
+    # Highlighted HTML (the inside of a <pre><code>) for a snippet body
+    key = cache_key(content, language)
+    html = cache.get(key)
+    if html is None:
+        html = pygments_highlight(content or '', _lexer(language), _formatter)
+        cache.set(key, html)
+    return Markup(html)
+
+
+def truncate(content, max_lines=PREVIEW_LINES, max_chars=PREVIEW_CHARS):
+    # First few lines of a snippet for feed cards; returns (text, truncated)
+    content = content or ''
+    lines = content.split('\n')
+    preview = '\n'.join(lines[:max_lines])[:max_chars]
+    return preview, len(preview) < len(content.rstrip('\n'))
+
+
+def make_preview(content):
+    # (preview, line_count) as stored on Snippet. The preview keeps one
+    # character past PREVIEW_CHARS so snippet_preview can tell it was cut.
+    content = content or ''
+    preview = '\n'.join(content.split('\n')[:PREVIEW_LINES])[:PREVIEW_CHARS + 1]
+    return preview, len(content.rstrip('\n').splitlines())
+
+
+def highlight_preview(content, language):
+    preview, truncated = truncate(content)
+    return _with_ellipsis(highlight(preview, language), truncated)
+
+
+def snippet_preview(snippet):
+    # Feed-card preview from the stored Snippet.preview/line_count; rows not
+    # yet moved by `flask backfill-blobs` fall back to the full body
+    if snippet.preview is None:
+        return highlight_preview(snippet.content, snippet.language)
+    truncated = snippet.line_count > PREVIEW_LINES or len(snippet.preview) > PREVIEW_CHARS
+    return _with_ellipsis(highlight(snippet.preview[:PREVIEW_CHARS], snippet.language), truncated)
+
+
+def _with_ellipsis(html, truncated):
+    if truncated:
+        html += Markup('<span class="text-muted">…</span>')
+    return html
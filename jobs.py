@@ -0,0 +1,245 @@
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import db, Job
+
+# Database-backed job queue for work that should not hold up a request.
+#
+# enqueue() adds a row to the job table, in the same commit as whatever the
+# caller has pending, so a job never runs ahead of the write that queued it.
+# Workers claim the oldest due job with one UPDATE ... RETURNING whose
+# subquery selects it FOR UPDATE SKIP LOCKED on Postgres. SQLite serializes
+# writers, so there the same statement is already exclusive. A claim holds
+# the job for JOBS_VISIBILITY_TIMEOUT seconds. If its worker dies or stalls
+# past that, another worker picks the job up again. A job that raises is
+# retried with exponential backoff (JOBS_RETRY_DELAY doubling per attempt)
+# until it has had JOBS_MAX_ATTEMPTS tries. After that it stays in the
+# table as 'failed', with its last traceback (see `flask jobs`).
+#
+# JOBS_MODE:
+#   thread  (default) each web process runs one worker thread, started on
+#           its first request or enqueue, so preloaded gunicorn workers
+#           each get their own
+#   worker  web processes only enqueue; run `python worker.py` (or
+#           `flask worker`) alongside them, as many as needed
+#   sync    enqueue() runs the job inline and raises its errors. TESTING
+#           implies this.
+#
+# Handlers are registered with @queue.handler('kind') and receive the
+# payload as keyword arguments, so payloads must be JSON. A handler can run
+# more than once for the same job: after a failure part-way through, or
+# when a stalled worker's claim expires. So each handler does its work in a
+# single transaction, or checks what is already done.
+
+MAX_RETRY_DELAY = 3600
+HOUSEKEEPING_INTERVAL = 60
+
+
+class JobQueue:
+    def __init__(self):
+        self.app = None
+        self.handlers = {}
+        self.worker = None
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.housekept_at = 0
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_MODE', os.environ.get('JOBS_MODE', 'thread'))
+        app.config.setdefault('JOBS_VISIBILITY_TIMEOUT', int(os.environ.get('JOBS_VISIBILITY_TIMEOUT', 300)))
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', int(os.environ.get('JOBS_MAX_ATTEMPTS', 5)))
+        app.config.setdefault('JOBS_RETRY_DELAY', float(os.environ.get('JOBS_RETRY_DELAY', 10)))
+        app.config.setdefault('JOBS_POLL_INTERVAL', float(os.environ.get('JOBS_POLL_INTERVAL', 1.0)))
+        app.config.setdefault('JOBS_KEEP_DAYS', int(os.environ.get('JOBS_KEEP_DAYS', 7)))
+        self.app = app
+        atexit.register(self.shutdown)
+
+        @app.before_request
+        def start_worker_thread():
+            if self.threaded:
+                self._ensure_started()
+
+    @property
+    def synchronous(self):
+        return self.app.config['JOBS_MODE'] == 'sync' or self.app.testing
+
+    @property
+    def threaded(self):
+        return self.app.config['JOBS_MODE'] == 'thread' and not self.app.testing
+
+    def handler(self, kind):
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def enqueue(self, kind, delay=0, **payload):
+        # Commits the session. Returns the job id, or None if it ran inline.
+        if kind not in self.handlers:
+            raise ValueError(f"No job handler registered for {kind!r}")
+        if self.synchronous:
+            db.session.commit()
+            self.handlers[kind](**payload)
+            return None
+        job = Job(kind=kind, payload=json.dumps(payload), max_attempts=self.app.config['JOBS_MAX_ATTEMPTS'],
+                  run_at=datetime.utcnow() + timedelta(seconds=delay))
+        db.session.add(job)
+        db.session.commit()
+        if self.threaded:
+            self._ensure_started()
+            self.worker.wakeup.set()
+        return job.id
+
+    def _ensure_started(self):
+        if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            self.worker = Worker(self)
+            self.thread = threading.Thread(target=self.worker.run, name='job-worker', daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def shutdown(self, timeout=10):
+        # Let the thread finish the job it is running; anything still queued
+        # is picked up by the next worker
+        if self.thread and self.thread.is_alive() and self.pid == os.getpid():
+            self.worker.stop()
+            self.thread.join(timeout)
+
+    def claim(self, worker_name):
+        # The oldest due job, now held by this worker; None if nothing is due
+        now = datetime.utcnow()
+        due = db.or_(
+            db.and_(Job.status == 'queued', Job.run_at <= now),
+            db.and_(Job.status == 'running', Job.locked_until < now, Job.attempts < Job.max_attempts),
+        )
+        pick = db.select(Job.id).where(due).order_by(Job.run_at, Job.id).limit(1)\
+            .with_for_update(skip_locked=True).scalar_subquery()
+        job = db.session.execute(
+            db.update(Job).where(Job.id == pick)
+            .values(status='running', attempts=Job.attempts + 1, locked_by=worker_name,
+                    locked_until=now + timedelta(seconds=self.app.config['JOBS_VISIBILITY_TIMEOUT']))
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+            .execution_options(synchronize_session=False)
+        ).first()
+        db.session.commit()
+        return job
+
+    def execute(self, job, worker_name):
+        try:
+            self.handlers[job.kind](**json.loads(job.payload))
+        except Exception:
+            db.session.rollback()
+            self.app.logger.exception('Job %d (%s) failed on attempt %d of %d',
+                                      job.id, job.kind, job.attempts, job.max_attempts)
+            self._finish(job, worker_name, traceback.format_exc())
+        else:
+            self._finish(job, worker_name)
+
+    def _finish(self, job, worker_name, error=None):
+        now = datetime.utcnow()
+        if error is None:
+            values = {'status': 'done', 'finished_at': now, 'last_error': None}
+        elif job.attempts >= job.max_attempts:
+            values = {'status': 'failed', 'finished_at': now, 'last_error': error}
+        else:
+            delay = min(self.app.config['JOBS_RETRY_DELAY'] * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+            values = {'status': 'queued', 'run_at': now + timedelta(seconds=delay), 'last_error': error}
+        # Only while the claim is still ours: once it expires another worker
+        # may have taken the job over, and its outcome wins
+        db.session.execute(
+            db.update(Job).where(Job.id == job.id, Job.status == 'running', Job.locked_by == worker_name,
+                                 Job.attempts == job.attempts)
+            .values(locked_by=None, locked_until=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def housekeeping(self):
+        # At most once a minute per process: fail jobs whose worker died
+        # during their last attempt, and drop finished jobs past JOBS_KEEP_DAYS
+        if time.monotonic() - self.housekept_at < HOUSEKEEPING_INTERVAL:
+            return
+        self.housekept_at = time.monotonic()
+        now = datetime.utcnow()
+        db.session.execute(
+            db.update(Job).where(Job.status == 'running', Job.locked_until < now, Job.attempts >= Job.max_attempts)
+            .values(status='failed', finished_at=now, locked_by=None, locked_until=None,
+                    last_error=func.coalesce(Job.last_error, 'Worker stopped before the job finished'))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            db.delete(Job).where(Job.status == 'done',
+                                 Job.finished_at < now - timedelta(days=self.app.config['JOBS_KEEP_DAYS']))
+        )
+        db.session.commit()
+
+    def counts(self):
+        # {status: number of jobs}
+        return dict(db.session.execute(db.select(Job.status, func.count(Job.id)).group_by(Job.status)).all())
+
+    def failed(self, limit=20):
+        return db.session.execute(
+            db.select(Job).where(Job.status == 'failed').order_by(Job.finished_at.desc()).limit(limit)
+        ).scalars().all()
+
+    def retry_failed(self):
+        # Queue every failed job again with a fresh set of attempts
+        result = db.session.execute(
+            db.update(Job).where(Job.status == 'failed')
+            .values(status='queued', attempts=0, run_at=datetime.utcnow(), finished_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount
+
+
+class Worker:
+    def __init__(self, jobs, name=None):
+        self.jobs = jobs
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+
+    def run(self, burst=False):
+        # Work until stop(); with burst, return as soon as nothing is due.
+        # Returns the number of jobs run.
+        app = self.jobs.app
+        done = 0
+        while not self.stopping.is_set():
+            with app.app_context():
+                try:
+                    job = self.jobs.claim(self.name)
+                    if job is None:
+                        self.jobs.housekeeping()
+                    else:
+                        self.jobs.execute(job, self.name)
+                        done += 1
+                except Exception:
+                    # Database unreachable and the like; wait and try again
+                    db.session.rollback()
+                    app.logger.exception('Job worker %s could not poll the queue', self.name)
+                    job = None
+            if job is not None:
+                continue
+            if burst:
+                break
+            self.wakeup.wait(app.config['JOBS_POLL_INTERVAL'])
+            self.wakeup.clear()
+        return done
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+
+queue = JobQueue()
@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from flask import Response, abort, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# Per-request performance instrumentation.
+#
+# SQLAlchemy cursor events count queries and time them, Jinja render signals
+# time templates, and TimedQueuePool times how long a request waited for a
+# pooled connection. Each request's totals go into per-endpoint histograms,
+# which /metrics serves in Prometheus text format (per process; scrape every
+# worker or aggregate upstream). With METRICS_HEADERS (on in debug), the
+# totals are also sent back as X-* and Server-Timing headers. Requests that
+# are slow or issue too many queries are logged with their worst statements,
+# so N+1 regressions show up in the logs.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_STATEMENTS_REPORTED = 5
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels tuple -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                labels = ','.join(f'{k}="{v}"' for k, v in key)
+                sep = ',' if labels else ''
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {series[-1]}')
+                lines.append(f'{self.name}_sum{{{labels}}} {series[-2]:.6f}')
+                lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return '\n'.join(lines)
+
+
+REQUEST_SECONDS = Histogram('codesnap_request_duration_seconds', 'Request wall time.', DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram('codesnap_request_queries', 'SQL statements issued per request.', QUERY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('codesnap_request_db_seconds', 'Time spent executing SQL per request.', DURATION_BUCKETS)
+REQUEST_RENDER_SECONDS = Histogram('codesnap_request_render_seconds', 'Template render time per request.', DURATION_BUCKETS)
+POOL_WAIT_SECONDS = Histogram('codesnap_pool_wait_seconds', 'Time spent waiting to check out a pooled connection.', DURATION_BUCKETS)
+HISTOGRAMS = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, REQUEST_RENDER_SECONDS, POOL_WAIT_SECONDS]
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.pool_wait = 0.0
+        self.render_depth = 0
+        self.render_started = 0.0
+        self.statements = []  # (seconds, sql) for the slow query report
+
+
+def _current():
+    return g.get('_metrics') if has_request_context() else None
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that reports how long each checkout waited for a connection
+    role = 'primary'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            POOL_WAIT_SECONDS.observe(waited, pool=self.role)
+            current = _current()
+            if current is not None:
+                current.pool_wait += waited
+
+
+_pool_classes = {'primary': TimedQueuePool}
+
+
+def pool_class(role):
+    # TimedQueuePool labelled with `role`. A subclass rather than an instance
+    # attribute, so the label survives engine.dispose() recreating the pool.
+    if role not in _pool_classes:
+        _pool_classes[role] = type(f"TimedQueuePool_{role}", (TimedQueuePool,), {'role': role})
+    return _pool_classes[role]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # One statement runs at a time per connection, so a single start time
+    # will do; one left behind by a failed statement is simply overwritten
+    conn.info['_query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('_query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    current = _current()
+    if current is not None:
+        current.queries += 1
+        current.db_time += elapsed
+        current.statements.append((elapsed, statement))
+
+
+def _before_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None:
+        # Only time the outermost render; cached card renders nest inside pages
+        if current.render_depth == 0:
+            current.render_started = time.perf_counter()
+        current.render_depth += 1
+
+
+def _after_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None and current.render_depth:
+        current.render_depth -= 1
+        if current.render_depth == 0:
+            current.render_time += time.perf_counter() - current.render_started
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_HEADERS', os.environ.get('METRICS_HEADERS') == '1')
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    app.config.setdefault('SLOW_REQUEST_MS', float(os.environ.get('SLOW_REQUEST_MS', 500)))
+    app.config.setdefault('SLOW_QUERY_COUNT', int(os.environ.get('SLOW_QUERY_COUNT', 20)))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('poolclass', TimedQueuePool)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def start_request_metrics():
+        g._metrics = RequestMetrics()
+
+    @app.after_request
+    def finish_request_metrics(response):
+        current = g.pop('_metrics', None)
+        if current is None:
+            return response
+        elapsed = time.perf_counter() - current.started
+        endpoint = request.endpoint or 'unknown'
+        if endpoint != 'metrics':
+            REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+            REQUEST_QUERIES.observe(current.queries, endpoint=endpoint)
+            REQUEST_DB_SECONDS.observe(current.db_time, endpoint=endpoint)
+            REQUEST_RENDER_SECONDS.observe(current.render_time, endpoint=endpoint)
+        # app.debug is read here rather than at init: app.run(debug=True)
+        # only turns it on after the app is set up
+        if app.config['METRICS_HEADERS'] or app.debug:
+            response.headers['X-Query-Count'] = str(current.queries)
+            response.headers['X-DB-Time-Ms'] = f"{current.db_time * 1000:.2f}"
+            response.headers['X-Render-Time-Ms'] = f"{current.render_time * 1000:.2f}"
+            response.headers['X-Pool-Wait-Ms'] = f"{current.pool_wait * 1000:.2f}"
+            response.headers['Server-Timing'] = (
+                f"db;dur={current.db_time * 1000:.2f}, render;dur={current.render_time * 1000:.2f}, "
+                f"pool;dur={current.pool_wait * 1000:.2f}, total;dur={elapsed * 1000:.2f}"
+            )
+        if elapsed * 1000 >= app.config['SLOW_REQUEST_MS'] or current.queries >= app.config['SLOW_QUERY_COUNT']:
+            worst = sorted(current.statements, reverse=True)[:SLOW_STATEMENTS_REPORTED]
+            app.logger.warning(
+                "Slow request %s %s: %.1fms total, %d queries, %.1fms db, %.1fms render, %.1fms pool wait\n%s",
+                request.method, request.path, elapsed * 1000, current.queries, current.db_time * 1000,
+                current.render_time * 1000, current.pool_wait * 1000,
+                '\n'.join(f"  {seconds * 1000:8.2f}ms  {' '.join(sql.split())[:300]}" for seconds, sql in worst),
+            )
+        return response
+
+    @app.get('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f"Bearer {token}":
+            abort(401)
+        body = '\n'.join(h.render() for h in HISTOGRAMS) + '\n'
+        return Response(body, mimetype='text/plain; version=0.0.4')
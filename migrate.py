@@ -0,0 +1,14 @@
+import sys
+from app import app
+import migrations
+
+# Run once per deploy, before the web workers start:
+#     python migrate.py && gunicorn app:app
+
+with app.app_context():
+    try:
+        ran = migrations.upgrade(echo=print)
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
+    print(f"✅ Applied {len(ran)} migrations." if ran else "✅ Schema is up to date.")
@@ -0,0 +1,213 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, text
+from models import db, Job, Snippet, SnippetBlob
+import search
+import ranking
+import stats as site_stats
+
+try:
+    import fcntl
+except ImportError:  # Windows: local runs are single process anyway
+    fcntl = None
+
+# Versioned schema migrations.
+#
+# Every schema change is a numbered step below. upgrade() runs the steps not
+# yet recorded in the schema_version table, in order, one transaction each.
+# It holds a lock for the whole run: a Postgres advisory lock, or a lock file
+# beside a SQLite database. So when several instances start together, one
+# migrates and the rest wait, then find nothing left to do. Deploys run
+# `python migrate.py` (or `flask migrate`) once before starting gunicorn.
+# Nothing here runs at import time.
+#
+# Databases that predate this table already carry some of these changes, so
+# each step checks what exists before altering anything. Never edit a step
+# that has shipped; append a new one.
+
+LOCK_KEY = 7283017  # pg_advisory_lock id shared by every codeSnap deploy
+
+_metadata = MetaData()
+schema_version = Table(
+    'schema_version', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        return func
+    return register
+
+
+def _columns(table):
+    return {column['name']: column for column in db.inspect(db.session.connection()).get_columns(table)}
+
+
+def _add_column(table, column, ddl):
+    # Returns True if the column was missing and has been added
+    if column in _columns(table):
+        return False
+    db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+    return True
+
+
+def _create_index(name, table, columns):
+    db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({columns})'))
+
+
+@migration(1, 'baseline tables')
+def _baseline():
+    # Fresh databases get the current schema in one go; later steps then
+    # find their columns and indexes already present
+    db.metadata.create_all(db.session.connection())
+
+
+@migration(2, 'widen user.password_hash')
+def _widen_password_hash():
+    # SQLite ignores VARCHAR lengths
+    length = getattr(_columns('user')['password_hash']['type'], 'length', None)
+    if db.engine.dialect.name == 'postgresql' and length and length < 256:
+        db.session.execute(text('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(256)'))
+
+
+@migration(3, 'user.is_moderator')
+def _add_is_moderator():
+    _add_column('user', 'is_moderator', 'BOOLEAN DEFAULT FALSE')
+
+
+@migration(4, 'snippet vote counters')
+def _add_vote_counters():
+    added = [_add_column('snippet', column, 'INTEGER NOT NULL DEFAULT 0')
+             for column in ('score', 'upvotes', 'downvotes')]
+    if any(added):
+        Snippet.reconcile_scores()
+
+
+@migration(5, 'snippet listing indexes')
+def _add_listing_indexes():
+    # (user_id, ...) also serves every plain Snippet.user_id lookup
+    _create_index('ix_snippet_public_created', 'snippet', 'is_public, created_at, id')
+    _create_index('ix_snippet_user_created', 'snippet', 'user_id, created_at, id')
+
+
+@migration(6, 'user leaderboard totals')
+def _add_user_totals():
+    added = [_add_column('user', column, 'INTEGER NOT NULL DEFAULT 0') for column in ('snippet_count', 'reputation')]
+    _create_index('ix_user_snippet_count', 'user', 'snippet_count')
+    _create_index('ix_user_reputation', 'user', 'reputation')
+    if any(added):
+        site_stats.rebuild()
+
+
+@migration(7, 'admin log indexes')
+def _add_admin_log_indexes():
+    _create_index('ix_admin_log_timestamp', 'admin_log', 'timestamp')
+    _create_index('ix_admin_log_admin_timestamp', 'admin_log', 'admin_id, timestamp')
+
+
+@migration(8, 'full-text search index')
+def _add_search_index():
+    if not search.index_exists():
+        search.rebuild()
+
+
+@migration(9, 'vote and audit action indexes')
+def _add_vote_indexes():
+    # Per-snippet vote tallies used to scan the whole vote table
+    _create_index('ix_vote_snippet_value', 'vote', 'snippet_id, value')
+    _create_index('ix_admin_log_action_timestamp', 'admin_log', 'action, timestamp')
+
+
+@migration(10, 'snippet ranking')
+def _add_hot_score():
+    _add_column('snippet', 'hot_score', 'FLOAT NOT NULL DEFAULT 0')
+    _create_index('ix_snippet_public_hot', 'snippet', 'is_public, hot_score, id')
+    _create_index('ix_snippet_public_score', 'snippet', 'is_public, score, id')
+    # Only rewrites rows whose score is off, so a rerun after a crash is cheap
+    ranking.rebuild()
+
+
+@migration(11, 'snippet blobs')
+def _add_snippet_blobs():
+    # Schema only: existing bodies keep working from the old column and are
+    # moved in batches by `flask backfill-blobs`, outside this transaction
+    SnippetBlob.__table__.create(db.session.connection(), checkfirst=True)
+    _add_column('snippet', 'content_hash', 'VARCHAR(64) REFERENCES snippet_blob (hash)')
+    _add_column('snippet', 'preview', 'TEXT')
+    _add_column('snippet', 'line_count', 'INTEGER')
+    _create_index('ix_snippet_content_hash', 'snippet', 'content_hash')
+
+
+@migration(12, 'job queue')
+def _add_job_table():
+    Job.__table__.create(db.session.connection(), checkfirst=True)
+
+
+@contextmanager
+def _lock():
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': LOCK_KEY})
+        return
+    database = db.engine.url.database
+    if fcntl is None or not database or database == ':memory:':
+        yield
+        return
+    if os.path.isabs(database):
+        path = f"{database}.migrate-lock"
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'codesnap.migrate-lock')
+    with open(path, 'w') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _applied():
+    return dict(db.session.execute(db.select(schema_version.c.version, schema_version.c.applied_at)).all())
+
+
+def upgrade(echo=None):
+    # Apply pending migrations; returns the (version, name) pairs that ran
+    ran = []
+    with _lock():
+        schema_version.create(db.engine, checkfirst=True)
+        applied = _applied()
+        for version, name, func in sorted(MIGRATIONS):
+            if version in applied:
+                continue
+            started = time.perf_counter()
+            try:
+                func()
+                db.session.execute(schema_version.insert().values(
+                    version=version, name=name, applied_at=datetime.utcnow()
+                ))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            ran.append((version, name))
+            if echo:
+                echo(f"  {version:>3}  {name} ({time.perf_counter() - started:.2f}s)")
+    return ran
+
+
+def status():
+    # [(version, name, applied_at or None)] for every known migration
+    applied = _applied() if db.inspect(db.engine).has_table('schema_version') else {}
+    return [(version, name, applied.get(version)) for version, name, _ in sorted(MIGRATIONS)]
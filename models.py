@@ -1,9 +1,33 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hasher
+from routing import RoutingSession
+from blobs import codec
+from highlight import make_preview
 from datetime import datetime
+from sqlalchemy import bindparam, func
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def dialect_insert(model):
+    # INSERT with the ON CONFLICT clauses of the dialect we run on
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def insert_ignoring_duplicates(model):
+    # INSERT ... ON CONFLICT DO NOTHING for the dialects we run on
+    return dialect_insert(model).on_conflict_do_nothing()
+
+
+class VoteConflict(Exception):
+    # A concurrent request cast the same vote while this one was running;
+    # the app answers 409 so the client can retry against the new state
+    pass
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,15 +35,52 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     country = db.Column(db.String(50), default='Unknown')
     is_moderator = db.Column(db.Boolean, default=False)
-    snippets = db.relationship('Snippet', backref='owner', lazy=True, cascade="all, delete-orphan")
+    # Denormalized totals behind the /stats leaderboards
+    snippet_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    reputation = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    # owner and admin are declared on their own classes, not as backrefs, so
+    # joinedload(Snippet.owner) works before the mappers are first configured
+    snippets = db.relationship('Snippet', back_populates='owner', lazy=True, cascade="all, delete-orphan")
     votes = db.relationship('Vote', backref='user', lazy=True, cascade="all, delete-orphan")
-    logs = db.relationship('AdminLog', backref='admin', lazy=True, cascade="all, delete-orphan", foreign_keys='AdminLog.admin_id')
+    logs = db.relationship('AdminLog', back_populates='admin', lazy=True, cascade="all, delete-orphan", foreign_keys='AdminLog.admin_id')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
+
+    @classmethod
+    def adjust_totals(cls, user_id, snippets=0, reputation=0):
+        # Atomic increment; returns the updated leaderboard fields for stats.py
+        return db.session.execute(
+            db.update(cls)
+            .where(cls.id == user_id)
+            .values(snippet_count=cls.snippet_count + snippets, reputation=cls.reputation + reputation)
+            .returning(cls.id, cls.username, cls.country, cls.is_moderator, cls.snippet_count, cls.reputation)
+            .execution_options(synchronize_session=False)
+        ).one()
+
+    @classmethod
+    def reconcile_totals(cls):
+        # Recompute snippet_count and reputation from the snippets in one
+        # set-based UPDATE, touching only the rows that have drifted.
+        # Returns the number fixed.
+        snippet_count = db.select(func.count(Snippet.id)).where(Snippet.user_id == cls.id).scalar_subquery()
+        reputation = func.coalesce(
+            db.select(func.sum(Snippet.score)).where(Snippet.user_id == cls.id).scalar_subquery(), 0
+        )
+        result = db.session.execute(
+            db.update(cls)
+            .where(db.or_(cls.snippet_count != snippet_count, cls.reputation != reputation))
+            .values(snippet_count=snippet_count, reputation=reputation)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount
 
 class AdminLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -27,23 +88,199 @@ class AdminLog(db.Model):
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True)
     action = db.Column(db.String(100), nullable=False)
     details = db.Column(db.Text, nullable=True)
+    admin = db.relationship('User', back_populates='logs', foreign_keys=[admin_id])
+
+    # Serve the paginated admin and per-user activity listings
+    __table_args__ = (
+        db.Index('ix_admin_log_timestamp', 'timestamp'),
+        db.Index('ix_admin_log_admin_timestamp', 'admin_id', 'timestamp'),
+        db.Index('ix_admin_log_action_timestamp', 'action', 'timestamp'),
+    )
+
+class Job(db.Model):
+    # One unit of deferred work; queued, claimed and retried by jobs.py
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments
+    status = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    # Workers poll for the oldest due job of a status
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at', 'id'),
+    )
+
+class SnippetBlob(db.Model):
+    # A snippet body, keyed by the SHA-256 of its text and shared by every
+    # snippet with the same text; encoding and compression in blobs.py
+    hash = db.Column(db.String(64), primary_key=True)
+    encoding = db.Column(db.String(8), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # UTF-8 bytes before compression
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def text(self):
+        if '_text' not in self.__dict__:
+            self._text = codec.decode(self.encoding, self.data)
+        return self._text
+
+    @classmethod
+    def store_many(cls, texts):
+        # Insert any bodies not stored yet; returns their hashes in order
+        hashes, rows = [], {}
+        for text in texts:
+            digest = codec.digest(text)
+            hashes.append(digest)
+            if digest not in rows:
+                encoding, data = codec.encode(text)
+                rows[digest] = {'hash': digest, 'encoding': encoding, 'data': data,
+                                'size': len(text.encode('utf-8'))}
+        if rows:
+            db.session.execute(insert_ignoring_duplicates(cls), list(rows.values()))
+        return hashes
+
+    @classmethod
+    def store(cls, text):
+        return cls.store_many([text])[0]
+
+    @classmethod
+    def prune(cls, older_than):
+        # Delete blobs no snippet refers to any more. The cutoff spares
+        # blobs written moments ago whose snippet has not committed yet.
+        # Returns the number removed.
+        result = db.session.execute(
+            db.delete(cls).where(
+                cls.created_at < older_than,
+                ~db.select(Snippet.id).where(Snippet.content_hash == cls.hash).exists(),
+            )
+        )
+        db.session.commit()
+        return result.rowcount
+
+    @classmethod
+    def totals(cls):
+        # (blob count, text bytes, stored bytes)
+        return db.session.execute(
+            db.select(func.count(cls.hash), func.coalesce(func.sum(cls.size), 0),
+                      func.coalesce(func.sum(func.length(cls.data)), 0))
+        ).one()
 
 class Snippet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    # The body lives in SnippetBlob (see `content`). Rows written before
+    # blobs existed keep it in this column until `flask backfill-blobs`.
+    legacy_content = db.deferred(db.Column('content', db.Text, nullable=False, default='', server_default=''))
+    content_hash = db.Column(db.String(64), db.ForeignKey('snippet_blob.hash'), index=True)
+    # Feed-card preview and body length, so listings never load the body
+    preview = db.Column(db.Text)
+    line_count = db.Column(db.Integer)
     language = db.Column(db.String(50), default='javascript')
     is_public = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Denormalized vote tallies, kept in step with the Vote table by vote()
+    score = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    upvotes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    downvotes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Time-decayed rank for the trending feed; maintained by ranking.py
+    hot_score = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    owner = db.relationship('User', back_populates='snippets')
     votes = db.relationship('Vote', backref='snippet', lazy='dynamic', cascade="all, delete-orphan")
 
+    # Serve the keyset-paginated feeds and profile listings
+    __table_args__ = (
+        db.Index('ix_snippet_public_created', 'is_public', 'created_at', 'id'),
+        db.Index('ix_snippet_public_hot', 'is_public', 'hot_score', 'id'),
+        db.Index('ix_snippet_public_score', 'is_public', 'score', 'id'),
+        db.Index('ix_snippet_user_created', 'user_id', 'created_at', 'id'),
+    )
+
     @property
-    def score(self):
-        return sum(vote.value for vote in self.votes)
+    def content(self):
+        if self.content_hash is None:
+            return self.legacy_content
+        return db.session.get(SnippetBlob, self.content_hash).text
 
-    def get_user_vote(self, user_id):
-        return self.votes.filter_by(user_id=user_id).first()
+    @content.setter
+    def content(self, text):
+        text = text or ''
+        self.content_hash = SnippetBlob.store(text)
+        self.preview, self.line_count = make_preview(text)
+        self.legacy_content = ''
+
+    @classmethod
+    def backfill_blobs(cls, batch_size=500, echo=None):
+        # Move bodies still in the legacy column into SnippetBlob, one batch
+        # per transaction. Returns the number of snippets moved.
+        table = cls.__table__
+        move = db.update(table).where(table.c.id == bindparam('b_id')).values(
+            content_hash=bindparam('b_hash'), preview=bindparam('b_preview'),
+            line_count=bindparam('b_lines'), content='',
+        )
+        moved = 0
+        while True:
+            rows = db.session.execute(
+                db.select(cls.id, cls.legacy_content).where(cls.content_hash.is_(None))
+                .order_by(cls.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return moved
+            hashes = SnippetBlob.store_many([row.legacy_content for row in rows])
+            changes = []
+            for row, digest in zip(rows, hashes):
+                preview, line_count = make_preview(row.legacy_content)
+                changes.append({'b_id': row.id, 'b_hash': digest, 'b_preview': preview, 'b_lines': line_count})
+            db.session.execute(move, changes)
+            db.session.commit()
+            moved += len(rows)
+            if echo:
+                echo(moved)
+
+    @classmethod
+    def apply_vote_change(cls, snippet_id, old_value, new_value):
+        # old_value/new_value are 1, -1 or 0 (no vote). Runs as a single UPDATE
+        # so concurrent voters never overwrite each other's counts. Returns
+        # the new score.
+        return db.session.execute(
+            db.update(cls)
+            .where(cls.id == snippet_id)
+            .values(
+                score=cls.score + (new_value - old_value),
+                upvotes=cls.upvotes + (new_value == 1) - (old_value == 1),
+                downvotes=cls.downvotes + (new_value == -1) - (old_value == -1),
+            )
+            .returning(cls.score)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+
+    @classmethod
+    def reconcile_scores(cls):
+        # Rebuild every counter from the Vote table in one set-based UPDATE,
+        # touching only the rows that have drifted. Returns the number fixed.
+        def tally(expr, *criteria):
+            return func.coalesce(
+                db.select(expr).where(Vote.snippet_id == cls.id, *criteria).scalar_subquery(), 0
+            )
+        score = tally(func.sum(Vote.value))
+        upvotes = tally(func.count(Vote.id), Vote.value == 1)
+        downvotes = tally(func.count(Vote.id), Vote.value == -1)
+        result = db.session.execute(
+            db.update(cls)
+            .where(db.or_(cls.score != score, cls.upvotes != upvotes, cls.downvotes != downvotes))
+            .values(score=score, upvotes=upvotes, downvotes=downvotes)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount
 
 class Vote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,4 +288,75 @@ class Vote(db.Model):
     snippet_id = db.Column(db.Integer, db.ForeignKey('snippet.id'), nullable=False)
     value = db.Column(db.Integer, nullable=False) # 1 for upvote, -1 for downvote
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'snippet_id', name='_user_snippet_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'snippet_id', name='_user_snippet_uc'),
+        # Per-snippet tallies (reconcile, deletes); user lookups use the constraint above
+        db.Index('ix_vote_snippet_value', 'snippet_id', 'value'),
+    )
+
+    @classmethod
+    def cast(cls, user_id, snippet_id, value):
+        # Toggle a vote without reading it first: repeating a vote deletes
+        # it, otherwise one upsert inserts it or flips the opposite vote.
+        # Returns (old_value, new_value). Raises VoteConflict when the same
+        # vote landed from another request between the two statements.
+        mine = (cls.user_id == user_id, cls.snippet_id == snippet_id)
+        removed = db.session.execute(
+            db.delete(cls).where(*mine, cls.value == value).returning(cls.id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if removed:
+            return value, 0
+        if db.engine.dialect.name == 'postgresql':
+            # xmax stays 0 on a row the statement inserted; an update sets it
+            inserted = db.literal_column('xmax = 0')
+        else:
+            # SQLite: the DELETE above took the database write lock, which
+            # holds until commit, so this read cannot go stale
+            inserted = db.literal(db.session.execute(db.select(cls.id).where(*mine)).first() is None)
+        upsert = dialect_insert(cls).values(user_id=user_id, snippet_id=snippet_id, value=value)
+        row = db.session.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[cls.user_id, cls.snippet_id],
+                set_={'value': upsert.excluded.value},
+                where=cls.value != upsert.excluded.value,
+            ).returning(cls.id, inserted)
+        ).first()
+        if row is None:
+            # The row already holds this vote: a concurrent double click
+            # inserted or flipped it after our DELETE found nothing
+            raise VoteConflict()
+        return (0 if row[1] else -value), value
+
+    @classmethod
+    def values_for(cls, user_id, snippet_ids):
+        # The user's vote on each of many snippets in one query: {snippet_id: 1 | -1}
+        return dict(db.session.execute(
+            db.select(cls.snippet_id, cls.value).where(cls.user_id == user_id, cls.snippet_id.in_(snippet_ids))
+        ).all())
+
+    @classmethod
+    def retract_all(cls, user_id):
+        # Back every vote a user cast out of the snippet and owner counters,
+        # ahead of the vote rows being deleted along with the user
+        voted = db.select(cls.snippet_id).where(cls.user_id == user_id)
+        owners = db.select(Snippet.user_id).where(Snippet.id.in_(voted))
+        given = db.select(func.sum(cls.value))\
+            .join(Snippet, Snippet.id == cls.snippet_id)\
+            .where(cls.user_id == user_id, Snippet.user_id == User.id)\
+            .scalar_subquery()
+        db.session.execute(
+            db.update(User).where(User.id.in_(owners))
+            .values(reputation=User.reputation - func.coalesce(given, 0))
+            .execution_options(synchronize_session=False)
+        )
+        mine = db.select(cls.value).where(cls.user_id == user_id, cls.snippet_id == Snippet.id).scalar_subquery()
+        db.session.execute(
+            db.update(Snippet).where(Snippet.id.in_(voted))
+            .values(
+                score=Snippet.score - mine,
+                upvotes=Snippet.upvotes - db.case((mine == 1, 1), else_=0),
+                downvotes=Snippet.downvotes - db.case((mine == -1, 1), else_=0),
+            )
+            .execution_options(synchronize_session=False)
+        )
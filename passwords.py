@@ -0,0 +1,89 @@
+import os
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashing with a concurrency cap.
+#
+# A scrypt or PBKDF2 hash costs 100ms+ of CPU by design. When a burst of
+# logins or sign-ups hashed with no limit, the hashes took every core while
+# every other request queued behind them. The hash still runs on the request
+# thread, which has to wait for it anyway (hashlib releases the GIL, so other
+# request threads keep running), but at most PASSWORD_HASH_CONCURRENCY
+# hashes run at once per process. A request that cannot get a slot within
+# PASSWORD_HASH_TIMEOUT seconds fails fast with HashingBusy, which the app
+# serves as a 503 with Retry-After, so a login storm degrades instead of
+# stalling the site.
+#
+# PASSWORD_HASH_METHOD takes any Werkzeug method string, e.g. 'scrypt',
+# 'scrypt:16384:8:1' or 'pbkdf2:sha256:600000'. Hashes stored with other
+# parameters still verify and are re-hashed on the next successful login.
+# bench/hash_bench.py shows what each setting costs.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = 'scrypt'
+        self.concurrency = 2
+        self.timeout = 2.0
+        self.slots = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self._prefix = None
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'))
+        app.config.setdefault('PASSWORD_HASH_CONCURRENCY', int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 2)))
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', float(os.environ.get('PASSWORD_HASH_TIMEOUT', 2.0)))
+        self.configure(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_CONCURRENCY'],
+                       app.config['PASSWORD_HASH_TIMEOUT'])
+
+        @app.errorhandler(HashingBusy)
+        def hashing_busy(error):
+            return "Too many sign-ins in progress, please try again in a moment.", 503, {'Retry-After': '1'}
+
+    def configure(self, method, concurrency, timeout):
+        with self.lock:
+            self.method = method
+            self.concurrency = concurrency
+            self.timeout = timeout
+            self._prefix = None
+            self.pid = None  # rebuild the slots at the new size on next use
+
+    def _slots(self):
+        # One semaphore per process, created lazily so forked workers get
+        # their own rather than a copy of the master's state
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.slots = threading.BoundedSemaphore(self.concurrency)
+                    self.pid = os.getpid()
+        return self.slots
+
+    def run(self, func, *args):
+        slots = self._slots()
+        if not slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            return func(*args)
+        finally:
+            slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # Werkzeug fills in default costs ('scrypt' -> 'scrypt:32768:8:1'), so
+        # learn the full prefix for our method from one real hash
+        if self._prefix is None:
+            self._prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+hasher = PasswordHasher()
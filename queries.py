@@ -0,0 +1,124 @@
+import base64
+from datetime import datetime
+from sqlalchemy import func, tuple_, DateTime
+from sqlalchemy.orm import joinedload
+from models import db, Snippet, AdminLog
+import ranking
+
+# Loading layer for snippet listings. Every card needs the owner (username,
+# country and moderator flag for the badge) and the stored vote counters, so
+# owners are joined into the same SELECT and a page costs one query total.
+
+
+def with_owner():
+    return joinedload(Snippet.owner)
+
+
+FEED_SORT_COLUMNS = {
+    'new': Snippet.created_at,
+    'trending': Snippet.hot_score,
+    'top': Snippet.score,
+}
+
+
+def feed_query(sort='new', window='all'):
+    # Public Vault: public snippets by recency, hotness or net score,
+    # optionally limited to those posted within `window` (see ranking.py)
+    query = Snippet.query.options(with_owner()).filter_by(is_public=True)
+    since = ranking.window_start(window)
+    if since is not None:
+        query = query.filter(Snippet.created_at >= since)
+    return query.order_by(FEED_SORT_COLUMNS[sort].desc())
+
+
+def feed_key(sort='new'):
+    # The pagination key matching feed_query(sort)
+    return FEED_SORT_COLUMNS[sort], Snippet.id
+
+
+def profile_query(user, include_private=False):
+    # A user's own snippets; private ones only when the owner is looking
+    query = Snippet.query.options(with_owner()).filter_by(user_id=user.id)
+    if not include_private:
+        query = query.filter_by(is_public=True)
+    return query.order_by(Snippet.created_at.desc())
+
+
+def profile_totals(user, include_private=False):
+    # Snippet count and reputation (upvotes) in one aggregate query
+    query = db.session.query(func.count(Snippet.id), func.coalesce(func.sum(Snippet.upvotes), 0))\
+        .filter(Snippet.user_id == user.id)
+    if not include_private:
+        query = query.filter(Snippet.is_public == True)  # noqa: E712
+    return query.one()
+
+
+# Keyset pagination over (sort value, id), descending. The sort value is a
+# timestamp for the newest-first listings and a number for the ranked feeds.
+# The cursor names the last row the client has seen, so page N costs the same
+# index range scan as page 1 (backed by the composite indexes on Snippet and
+# AdminLog) instead of an OFFSET skip.
+
+PAGE_SIZE = 10
+LOG_PAGE_SIZE = 50
+
+
+def encode_cursor(value, row_id):
+    raw = f"{value.isoformat() if isinstance(value, datetime) else repr(value)}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parse=datetime.fromisoformat):
+    # Returns (sort value, id), or None for a missing or mangled cursor
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        value, row_id = raw.split('|')
+        return parse(value), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def paginate(query, cursor=None, per_page=PAGE_SIZE, key=(Snippet.created_at, Snippet.id)):
+    # `query` must already be ordered by key[0] desc (feed_query, log_query, ...)
+    sort_column, id_column = key
+    parse = datetime.fromisoformat if isinstance(sort_column.type, DateTime) else sort_column.type.python_type
+    position = decode_cursor(cursor, parse)
+    if position:
+        query = query.filter(tuple_(sort_column, id_column) < position)
+    rows = query.order_by(id_column.desc()).limit(per_page + 1).all()
+    page = rows[:per_page]
+    last = page[-1] if page else None
+    next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key)) \
+        if len(rows) > per_page else None
+    return page, next_cursor
+
+
+def log_filters(action=None, admin_id=None, since=None, until=None):
+    # Criteria shared by the audit log listing and its streamed export
+    criteria = []
+    if action:
+        criteria.append(AdminLog.action == action)
+    if admin_id is not None:
+        criteria.append(AdminLog.admin_id == admin_id)
+    if since:
+        criteria.append(AdminLog.timestamp >= since)
+    if until:
+        criteria.append(AdminLog.timestamp < until)
+    return criteria
+
+
+def log_query(criteria=()):
+    # Audit log listing, newest first, with authors joined in
+    return AdminLog.query.options(joinedload(AdminLog.admin))\
+        .filter(*criteria)\
+        .order_by(AdminLog.timestamp.desc())
+
+
+def paginate_logs(query, cursor=None, per_page=LOG_PAGE_SIZE):
+    return paginate(query, cursor, per_page, key=(AdminLog.timestamp, AdminLog.id))
+
+
+def get_snippet_or_404(snippet_id):
+    return db.get_or_404(Snippet, snippet_id, options=[with_owner()])
@@ -0,0 +1,97 @@
+import math
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, event
+from models import db, Snippet
+
+# Feed rankings: newest, trending and top.
+#
+# "Trending" orders by Snippet.hot_score, the Reddit formula: log10 of the
+# net score plus the age bonus created_at / DECAY_SECONDS. A snippet needs
+# ten times the votes to rank level with one posted DECAY_SECONDS later, so
+# older snippets sink without anything being rewritten over time. The score
+# changes only when votes change it, so vote() refreshes it in the same
+# transaction as the counters (votes.py does so per batch). rebuild()
+# recomputes every row after bulk changes such as reconciles, imports or a
+# formula change. Trending and top pages both read an (is_public, column,
+# id) index, so their cost does not grow with the number of votes.
+#
+# Windows (day/week) start on the hour, so a windowed page stays the same
+# for the whole hour and its conditional-GET validators can depend on it.
+
+EPOCH = datetime(2024, 1, 1)
+DECAY_SECONDS = 45000  # 12.5 hours per order of magnitude of votes
+REBUILD_BATCH = 1000
+
+SORTS = ('new', 'trending', 'top')
+WINDOWS = {'day': timedelta(days=1), 'week': timedelta(days=7), 'all': None}
+
+
+def hot(score, created_at):
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    return round(sign * order + (created_at - EPOCH).total_seconds() / DECAY_SECONDS, 7)
+
+
+def parse(sort, window):
+    # Unknown values fall back to the defaults rather than erroring
+    return (sort if sort in SORTS else 'new'), (window if window in WINDOWS else 'all')
+
+
+def window_start(window):
+    span = WINDOWS.get(window)
+    if span is None:
+        return None
+    return datetime.utcnow().replace(minute=0, second=0, microsecond=0) - span
+
+
+def feed_clock(window):
+    # Extra validator stamp for cache.conditional: windowed pages change on the hour
+    return time.time() // 3600 * 3600 if WINDOWS.get(window) else 0
+
+
+@event.listens_for(Snippet, 'before_insert')
+def _initial_hot_score(mapper, connection, target):
+    # ORM inserts; bulk inserts (transfer.py) set hot_score themselves
+    if target.created_at is None:
+        target.created_at = datetime.utcnow()
+    target.hot_score = hot(target.score or 0, target.created_at)
+
+
+_hot_update = db.update(Snippet.__table__)\
+    .where(Snippet.__table__.c.id == bindparam('b_id'))\
+    .values(hot_score=bindparam('b_hot'))
+
+
+def refresh(snippet_id, score, created_at):
+    # After a vote changed `score`; call inside the vote's transaction
+    db.session.execute(_hot_update, [{'b_id': snippet_id, 'b_hot': hot(score, created_at)}])
+
+
+def refresh_many(snippet_ids):
+    rows = db.session.execute(
+        db.select(Snippet.id, Snippet.score, Snippet.created_at).where(Snippet.id.in_(snippet_ids))
+    ).all()
+    if rows:
+        db.session.execute(_hot_update, [
+            {'b_id': row.id, 'b_hot': hot(row.score, row.created_at or EPOCH)} for row in rows
+        ])
+
+
+def rebuild():
+    # Recompute every snippet's hot score in batches of REBUILD_BATCH ids
+    last_id, updated = 0, 0
+    while True:
+        rows = db.session.execute(
+            db.select(Snippet.id, Snippet.score, Snippet.created_at, Snippet.hot_score)
+            .where(Snippet.id > last_id).order_by(Snippet.id).limit(REBUILD_BATCH)
+        ).all()
+        if not rows:
+            return updated
+        changes = [{'b_id': row.id, 'b_hot': hot(row.score, row.created_at or EPOCH)} for row in rows]
+        changes = [c for c, row in zip(changes, rows) if c['b_hot'] != row.hot_score]
+        if changes:
+            db.session.execute(_hot_update, changes)
+        db.session.commit()
+        updated += len(changes)
+        last_id = rows[-1].id
@@ -1,4 +1,5 @@
-from app import app, db
+from app import app
+import migrations
 import os
 
 with app.app_context():
@@ -10,6 +11,6 @@ with app.app_context():
         os.remove('snippets.db')
         print("🗑️  Deleted old database: snippets.db")
     
-    db.create_all()
+    migrations.upgrade()
     print("✅ Created fresh database tables (User, Snippet, Vote).")
     print("ℹ️  You will need to register a new user.")
@@ -0,0 +1,116 @@
+import os
+import random
+import re
+import time
+from functools import wraps
+from flask import g, has_request_context, session as client_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import TextClause
+import metrics
+
+# Read-replica routing.
+#
+# DATABASE_REPLICA_URLS (comma separated) adds one engine per replica as the
+# binds replica1, replica2, ... Inside a view marked @read_only, SELECTs go
+# to one replica, picked at random once per request. Everything else goes to
+# the primary:
+#   - writes and flushes, and anything after them in the same session
+#   - all work outside a request (CLI, migrations, background threads)
+#   - every request from a client that wrote within REPLICA_STICKY_SECONDS
+# The last rule gives read-your-writes: a vote or an edit marks the client's
+# session cookie, and its reads stay on the primary until the replicas have
+# had time to catch up.
+#
+# Primary and replicas have separate pools, each sized with its own DB_* and
+# DB_REPLICA_* settings. Pool checkout waits are labelled pool="primary" or
+# pool="replica" in codesnap_pool_wait_seconds (see metrics.py).
+
+BIND_PREFIX = 'replica'
+STICKY_KEY = '_primary_until'
+
+_SELECT_TEXT = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+
+
+def _bool(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(prefix='DB_', defaults=None):
+    # Pool settings for one role from the environment, e.g. DB_POOL_SIZE or
+    # DB_REPLICA_POOL_SIZE; unset values fall back to `defaults`
+    defaults = defaults or {}
+    env = os.environ.get
+    return {
+        'pool_size': int(env(f'{prefix}POOL_SIZE', defaults.get('pool_size', 5))),
+        'max_overflow': int(env(f'{prefix}MAX_OVERFLOW', defaults.get('max_overflow', 0))),
+        'pool_timeout': float(env(f'{prefix}POOL_TIMEOUT', defaults.get('pool_timeout', 30))),
+        'pool_recycle': int(env(f'{prefix}POOL_RECYCLE', defaults.get('pool_recycle', 300))),
+        'pool_pre_ping': _bool(env(f'{prefix}POOL_PRE_PING', defaults.get('pool_pre_ping', True))),
+    }
+
+
+def _normalize_url(url):
+    url = url.strip().strip('"').strip("'")
+    return url.replace('postgres://', 'postgresql://', 1) if url.startswith('postgres://') else url
+
+
+def init_app(app):
+    # Before db.init_app, after metrics.init_app (which picks the pool class)
+    urls = os.environ.get('DATABASE_REPLICA_URLS', '')
+    app.config.setdefault('DATABASE_REPLICA_URLS', [_normalize_url(u) for u in urls.split(',') if u.strip()])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', float(os.environ.get('REPLICA_STICKY_SECONDS', 5)))
+    primary = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    replica = dict(primary, **engine_options('DB_REPLICA_', defaults=primary))
+    replica['poolclass'] = metrics.pool_class('replica')
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for n, url in enumerate(app.config['DATABASE_REPLICA_URLS'], 1):
+        binds[f'{BIND_PREFIX}{n}'] = dict(replica, url=url)
+
+    @app.after_request
+    def mark_writer(response):
+        if g.get('_db_wrote'):
+            client_session[STICKY_KEY] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        return response
+
+
+def read_only(view):
+    # Lets the view's SELECTs run on a replica; see the module comment
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _is_read(clause):
+    if isinstance(clause, TextClause):
+        return bool(_SELECT_TEXT.match(clause.text))
+    return getattr(clause, 'is_select', False)
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or (clause is not None and not _is_read(clause)):
+                g._db_wrote = True
+                self.info['wrote'] = True
+            elif clause is not None and self._replica_allowed():
+                return self._db.engines[self._replica_key()]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_keys(self):
+        return [key for key in self._db.engines if key and key.startswith(BIND_PREFIX)]
+
+    def _replica_allowed(self):
+        return (
+            g.get('_db_read_only')
+            and not self.info.get('wrote')
+            and not (self.new or self.dirty or self.deleted)
+            and client_session.get(STICKY_KEY, 0) < time.time()
+            and bool(self._replica_keys())
+        )
+
+    def _replica_key(self):
+        if '_db_replica' not in g:
+            g._db_replica = random.choice(self._replica_keys())
+        return g._db_replica
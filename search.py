@@ -0,0 +1,202 @@
+import re
+from sqlalchemy import bindparam, text
+from blobs import codec
+from models import db, Snippet
+from queries import with_owner
+
+# Full-text snippet search over title, content, language and owner.
+#
+# The inverted index lives beside the snippet table: an FTS5 virtual table on
+# SQLite, a tsvector column with a GIN index on Postgres. Rows are rewritten
+# in the same transaction as the snippet write that changed them. Visibility
+# is never copied into the index; results are joined back to snippet and
+# filtered on is_public at query time, so a privacy toggle is reflected
+# immediately without touching the index.
+
+SEARCH_PAGE_SIZE = 10
+MAX_TERMS = 8
+REBUILD_BATCH = 500
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS snippet_fts USING fts5("
+    "title, content, language, owner, tokenize = 'unicode61')",
+)
+
+POSTGRES_DDL = (
+    "CREATE TABLE IF NOT EXISTS snippet_search ("
+    "snippet_id INTEGER PRIMARY KEY REFERENCES snippet (id) ON DELETE CASCADE, "
+    "document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_snippet_search_document ON snippet_search USING GIN (document)",
+)
+
+# Title hits outrank language/owner hits, which outrank body hits
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(:title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(:language, '')), 'B') || "
+    "setweight(to_tsvector('simple', :owner), 'B') || "
+    "setweight(to_tsvector('simple', :content), 'C')"
+)
+
+
+def _is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def index_exists():
+    return db.inspect(db.engine).has_table('snippet_search' if _is_postgres() else 'snippet_fts')
+
+
+def create_index():
+    for ddl in POSTGRES_DDL if _is_postgres() else SQLITE_DDL:
+        db.session.execute(text(ddl))
+    db.session.commit()
+
+
+def drop_index():
+    db.session.execute(text("DROP TABLE IF EXISTS snippet_search" if _is_postgres() else "DROP TABLE IF EXISTS snippet_fts"))
+    db.session.commit()
+
+
+_blobs_ready = False
+
+
+def _has_blobs():
+    # Migration 8 builds the index before migration 11 adds snippet blobs;
+    # until then every body is still in snippet.content
+    global _blobs_ready
+    if not _blobs_ready:
+        columns = db.inspect(db.session.connection()).get_columns('snippet')
+        _blobs_ready = any(column['name'] == 'content_hash' for column in columns)
+    return _blobs_ready
+
+
+def _documents(where, params, expanding=()):
+    # Index fields for every snippet matching `where` (SQL over s/u/b). Bodies
+    # are decoded here, since compressed blobs cannot be read from SQL.
+    bind = [bindparam(name, expanding=True) for name in expanding]
+    if _has_blobs():
+        blob_columns = "b.encoding, b.data"
+        blob_join = "LEFT JOIN snippet_blob b ON b.hash = s.content_hash"
+    else:
+        blob_columns, blob_join = "NULL AS encoding, NULL AS data", ""
+    rows = db.session.execute(text(
+        f"SELECT s.id, s.title, s.language, u.username, s.content, {blob_columns} "
+        f"FROM snippet s JOIN \"user\" u ON u.id = s.user_id "
+        f"{blob_join} WHERE {where}"
+    ).bindparams(*bind), params).all()
+    return [{
+        'id': row.id, 'title': row.title, 'language': row.language, 'owner': row.username,
+        'content': codec.decode(row.encoding, row.data) if row.encoding else row.content,
+    } for row in rows]
+
+
+def _reindex(where, params, expanding=()):
+    # Rewrite the index rows for every snippet matching `where` (SQL over s/u).
+    # Parameters named in `expanding` are lists, as in "s.id IN :ids".
+    documents = _documents(where, params, expanding)
+    if not documents:
+        return
+    if _is_postgres():
+        db.session.execute(text(
+            f"INSERT INTO snippet_search (snippet_id, document) VALUES (:id, {POSTGRES_DOCUMENT}) "
+            f"ON CONFLICT (snippet_id) DO UPDATE SET document = excluded.document"
+        ), documents)
+    else:
+        db.session.execute(text("DELETE FROM snippet_fts WHERE rowid IN :ids").bindparams(
+            bindparam('ids', expanding=True)), {'ids': [d['id'] for d in documents]})
+        db.session.execute(text(
+            "INSERT INTO snippet_fts (rowid, title, content, language, owner) "
+            "VALUES (:id, :title, :content, :language, :owner)"
+        ), documents)
+
+
+def index_snippet(snippet_id):
+    # Call after the snippet is flushed, before the commit
+    _reindex("s.id = :snippet_id", {'snippet_id': snippet_id})
+
+
+def index_snippets(snippet_ids):
+    # Bulk form of index_snippet, for imports
+    if snippet_ids:
+        _reindex("s.id IN :snippet_ids", {'snippet_ids': list(snippet_ids)}, expanding=('snippet_ids',))
+
+
+def reindex_user(user_id):
+    # Owner name is part of every document, so a rename touches all of them
+    _reindex("s.user_id = :user_id", {'user_id': user_id})
+
+
+def remove_snippet(snippet_id):
+    if _is_postgres():
+        db.session.execute(text("DELETE FROM snippet_search WHERE snippet_id = :id"), {'id': snippet_id})
+    else:
+        db.session.execute(text("DELETE FROM snippet_fts WHERE rowid = :id"), {'id': snippet_id})
+
+
+def remove_user(user_id):
+    table, key = ('snippet_search', 'snippet_id') if _is_postgres() else ('snippet_fts', 'rowid')
+    db.session.execute(text(
+        f"DELETE FROM {table} WHERE {key} IN (SELECT id FROM snippet WHERE user_id = :user_id)"
+    ), {'user_id': user_id})
+
+
+def rebuild():
+    create_index()
+    db.session.execute(text("DELETE FROM snippet_search" if _is_postgres() else "DELETE FROM snippet_fts"))
+    after = 0
+    while True:
+        ids = db.session.execute(
+            db.select(Snippet.id).where(Snippet.id > after).order_by(Snippet.id).limit(REBUILD_BATCH)
+        ).scalars().all()
+        if not ids:
+            break
+        index_snippets(ids)
+        after = ids[-1]
+    db.session.commit()
+
+
+def _terms(query):
+    return re.findall(r'\w+', query or '')[:MAX_TERMS]
+
+
+def _match_expression(terms):
+    # All terms must match; the last one is a prefix so results follow typing
+    if _is_postgres():
+        return ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+    return ' '.join([f'"{t}"' for t in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+def search_snippets(query, viewer_id=None, page=1, per_page=SEARCH_PAGE_SIZE):
+    # Returns (snippets, has_next) for one page of ranked results. Viewers
+    # see public snippets plus their own private ones.
+    terms = _terms(query)
+    if not terms:
+        return [], False
+    params = {
+        'match': _match_expression(terms),
+        'public': True,
+        'viewer': viewer_id or 0,
+        'limit': per_page + 1,
+        'offset': (page - 1) * per_page,
+    }
+    if _is_postgres():
+        sql = (
+            "SELECT ss.snippet_id FROM snippet_search ss JOIN snippet s ON s.id = ss.snippet_id "
+            "WHERE ss.document @@ to_tsquery('simple', :match) "
+            "AND (s.is_public = :public OR s.user_id = :viewer) "
+            "ORDER BY ts_rank_cd(ss.document, to_tsquery('simple', :match)) DESC, s.id DESC "
+            "LIMIT :limit OFFSET :offset"
+        )
+    else:
+        sql = (
+            "SELECT snippet_fts.rowid FROM snippet_fts JOIN snippet s ON s.id = snippet_fts.rowid "
+            "WHERE snippet_fts MATCH :match "
+            "AND (s.is_public = :public OR s.user_id = :viewer) "
+            "ORDER BY bm25(snippet_fts, 10.0, 1.0, 4.0, 4.0), s.id DESC "
+            "LIMIT :limit OFFSET :offset"
+        )
+    ids = db.session.execute(text(sql), params).scalars().all()
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    by_id = {s.id: s for s in Snippet.query.options(with_owner()).filter(Snippet.id.in_(ids))}
+    return [by_id[i] for i in ids if i in by_id], has_next
@@ -0,0 +1,44 @@
+// Infinite feed: streams more snippet cards from the JSON "next page" endpoint.
+// Without JavaScript the "Load more" link falls back to a full page with ?cursor=.
+(function () {
+    const feed = document.getElementById('feed');
+    const more = document.getElementById('feed-more');
+    const button = document.getElementById('feed-more-btn');
+    if (!feed || !more || !button) return;
+
+    let loading = false;
+
+    async function loadNextPage() {
+        const url = feed.dataset.nextUrl;
+        if (!url || loading) return;
+        loading = true;
+        button.textContent = 'Loading…';
+        try {
+            const response = await fetch(url, { headers: { 'Accept': 'application/json' } });
+            if (!response.ok) throw new Error(response.statusText);
+            const page = await response.json();
+            const holder = document.createElement('div');
+            holder.innerHTML = page.html;
+            const cards = Array.from(holder.children);
+            cards.forEach(card => feed.appendChild(card));
+            feed.dataset.nextUrl = page.next_url || '';
+        } catch (err) {
+            console.error('Failed to load more snippets', err);
+        } finally {
+            loading = false;
+            button.textContent = 'Load more';
+            if (!feed.dataset.nextUrl) more.remove();
+        }
+    }
+
+    button.addEventListener('click', event => {
+        event.preventDefault();
+        loadNextPage();
+    });
+
+    if ('IntersectionObserver' in window) {
+        new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+        }, { rootMargin: '400px' }).observe(more);
+    }
+})();
@@ -0,0 +1,141 @@
+import threading
+import time
+from types import SimpleNamespace
+from sqlalchemy import func
+from models import db, User, Snippet, Vote
+
+# In-process snapshot behind /stats. The leaderboards read the indexed
+# User.snippet_count / User.reputation counters, and every write the app
+# makes patches the cached top-10 lists in place rather than re-running the
+# GROUP BY joins. A TTL bounds how stale a worker can get from writes made
+# in other processes.
+
+LEADERBOARD_SIZE = 10
+
+
+class Leaderboard:
+    def __init__(self, column, label, ranked=None, size=LEADERBOARD_SIZE):
+        self.column = column  # User counter this board ranks by
+        self.label = label    # attribute name the template reads the value from
+        # Which users the board ranks. By default those with a positive
+        # counter; a board given its own clause also ranks zero and below.
+        self.ranked = ranked
+        self.size = size
+        self.entries = None   # None means "not loaded / stale"
+
+    def load(self):
+        rows = db.session.query(User.username, User.country, User.id, User.is_moderator, self.column)\
+            .filter(self.column > 0 if self.ranked is None else self.ranked)\
+            .order_by(self.column.desc(), User.id)\
+            .limit(self.size).all()
+        self.entries = [self._entry(row, row[4]) for row in rows]
+
+    def _entry(self, user, value):
+        return SimpleNamespace(username=user.username, country=user.country, id=user.id,
+                               is_moderator=user.is_moderator, **{self.label: value})
+
+    def update(self, user, value):
+        # Apply one user's new counter value to the cached list
+        if self.entries is None:
+            return
+        existing = next((e for e in self.entries if e.id == user.id), None)
+        if existing is not None and value < getattr(existing, self.label) and len(self.entries) == self.size:
+            # Someone outside the cached top-N may now outrank this user
+            self.entries = None
+            return
+        entries = [e for e in self.entries if e.id != user.id]
+        if value > 0:
+            entries.append(self._entry(user, value))
+        elif self.ranked is not None and (len(entries) < self.size or
+                                          (-value, user.id) < (-getattr(entries[-1], self.label), entries[-1].id)):
+            # Whether this user belongs on the board depends on more than
+            # the counter; reload rather than guess
+            self.entries = None
+            return
+        entries.sort(key=lambda e: (-getattr(e, self.label), e.id))
+        self.entries = entries[:self.size]
+
+
+class StatsSnapshot:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.snippet_board = Leaderboard(User.snippet_count, 'count')
+        # Like the original GROUP BY join: everyone whose snippets have
+        # received a vote, even if the votes net to zero or below
+        voted = db.select(Vote.id).join(Snippet, Snippet.id == Vote.snippet_id).where(Snippet.user_id == User.id)
+        self.reputation_board = Leaderboard(User.reputation, 'reputation', ranked=voted.exists())
+        self.user_count = None
+        self.countries = None
+        self.loaded_at = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.user_count = None
+            self.countries = None
+            self.snippet_board.entries = None
+            self.reputation_board.entries = None
+
+    def get(self):
+        with self.lock:
+            if time.monotonic() - self.loaded_at > self.ttl:
+                self.user_count = self.countries = None
+                self.snippet_board.entries = self.reputation_board.entries = None
+                self.loaded_at = time.monotonic()
+            if self.user_count is None or self.countries is None:
+                self.countries = dict(db.session.query(User.country, func.count(User.id)).group_by(User.country).all())
+                self.user_count = sum(self.countries.values())
+            for board in (self.snippet_board, self.reputation_board):
+                if board.entries is None:
+                    board.load()
+            return {
+                'user_count': self.user_count,
+                'top_snippet_users': list(self.snippet_board.entries),
+                'top_reputation_users': list(self.reputation_board.entries),
+                'country_labels': list(self.countries),
+                'country_data': list(self.countries.values()),
+            }
+
+    def record_totals(self, user):
+        # `user` is a row returned by User.adjust_totals()
+        with self.lock:
+            self.snippet_board.update(user, user.snippet_count)
+            self.reputation_board.update(user, user.reputation)
+
+    def record_user_added(self, country):
+        with self.lock:
+            if self.countries is not None:
+                self.countries[country] = self.countries.get(country, 0) + 1
+                self.user_count += 1
+
+
+snapshot = StatsSnapshot()
+
+
+def init_app(app):
+    app.config.setdefault('STATS_CACHE_TTL', 60)
+    snapshot.ttl = app.config['STATS_CACHE_TTL']
+
+
+def get_stats():
+    return snapshot.get()
+
+
+def record_totals(user):
+    snapshot.record_totals(user)
+
+
+def record_user_added(country):
+    snapshot.record_user_added(country)
+
+
+def invalidate():
+    snapshot.invalidate()
+
+
+def rebuild():
+    # Recompute every per-user counter from scratch (after reconciling the
+    # per-snippet vote counters they are derived from)
+    Snippet.reconcile_scores()
+    User.reconcile_totals()
+    snapshot.invalidate()
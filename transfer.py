@@ -0,0 +1,269 @@
+import io
+import json
+import zipfile
+from collections import Counter
+from datetime import datetime, timezone
+from blobs import codec
+from highlight import make_preview
+from models import db, User, Snippet, SnippetBlob, Vote, insert_ignoring_duplicates
+import search
+import ranking
+import stats as site_stats
+
+# Bulk export and import of snippet collections.
+#
+# The export format is NDJSON: a meta line, then one line per snippet, then
+# one per vote cast on those snippets. Votes name the snippet by its
+# exported id and the voter by username. ZIP exports wrap the same stream as
+# snippets.ndjson. Both are generated from yield_per cursors in ~64KB
+# chunks, so memory use stays flat however large the collection is.
+#
+# Imports read the same stream and insert CHUNK_SIZE snippets per
+# transaction with one executemany INSERT ... RETURNING, after storing the
+# chunk's bodies as blobs in one more. The returned ids are
+# indexed for search in bulk and used to re-point imported votes.
+# Per-user counters are adjusted once per chunk. Whole-instance imports
+# rebuild every counter at the end instead. Callers write one summary audit
+# entry for the whole import.
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 1000
+ZIP_MEMBER = 'snippets.ndjson'
+STREAM_CHUNK_BYTES = 65536
+
+
+class TransferFormatError(ValueError):
+    pass
+
+
+# Export
+
+def _records(user_id=None):
+    scope = [Snippet.user_id == user_id] if user_id else []
+    yield {'type': 'meta', 'version': FORMAT_VERSION, 'exported_at': datetime.utcnow().isoformat()}
+    snippets = db.select(
+        Snippet.id, User.username, Snippet.title, Snippet.legacy_content, SnippetBlob.encoding, SnippetBlob.data,
+        Snippet.language, Snippet.is_public, Snippet.created_at,
+    ).join(User, User.id == Snippet.user_id).outerjoin(SnippetBlob, SnippetBlob.hash == Snippet.content_hash)
+    snippets = snippets.where(*scope).order_by(Snippet.id)
+    for row in db.session.execute(snippets.execution_options(yield_per=CHUNK_SIZE)):
+        content = codec.decode(row.encoding, row.data) if row.encoding else row.legacy_content
+        yield {
+            'type': 'snippet', 'id': row.id, 'owner': row.username, 'title': row.title, 'content': content,
+            'language': row.language, 'is_public': bool(row.is_public),
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+        }
+    votes = db.select(Vote.snippet_id, User.username, Vote.value).join(User, User.id == Vote.user_id)
+    if user_id:
+        votes = votes.where(Vote.snippet_id.in_(db.select(Snippet.id).where(*scope)))
+    for row in db.session.execute(votes.order_by(Vote.id).execution_options(yield_per=CHUNK_SIZE)):
+        yield {'type': 'vote', 'snippet_id': row.snippet_id, 'user': row.username, 'value': row.value}
+
+
+def stream_ndjson(user_id=None):
+    # A user's snippets (including private ones), or every snippet when
+    # user_id is None, with the votes cast on them
+    buffer = io.StringIO()
+    for record in _records(user_id):
+        buffer.write(json.dumps(record, separators=(',', ':')) + '\n')
+        if buffer.tell() >= STREAM_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ZipPipe:
+    # Write-only file object; zipfile streams into it without seeking
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(user_id=None):
+    pipe = _ZipPipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(ZIP_MEMBER, 'w', force_zip64=True) as member:
+            for chunk in stream_ndjson(user_id):
+                member.write(chunk.encode('utf-8'))
+                data = pipe.drain()
+                if data:
+                    yield data
+    yield pipe.drain()
+
+
+# Import
+
+def read_records(fileobj):
+    # Yield records from an NDJSON or ZIP export (a seekable binary file)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            if ZIP_MEMBER not in archive.namelist():
+                raise TransferFormatError(f"archive has no {ZIP_MEMBER}")
+            with archive.open(ZIP_MEMBER) as member:
+                yield from _parse_lines(member)
+        return
+    fileobj.seek(0)
+    yield from _parse_lines(fileobj)
+
+
+def _parse_lines(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise TransferFormatError(f"line {number} is not valid JSON")
+        if not isinstance(record, dict):
+            raise TransferFormatError(f"line {number} is not a JSON object")
+        if record.get('type') == 'meta' and record.get('version', FORMAT_VERSION) > FORMAT_VERSION:
+            raise TransferFormatError(f"export format version {record['version']} is newer than this server")
+        yield record
+
+
+def _snippet_row(record):
+    title = str(record.get('title') or '').strip()[:120]
+    content = record.get('content')
+    if not title or not isinstance(content, str) or not content:
+        return None
+    try:
+        created_at = datetime.fromisoformat(record['created_at']) if record.get('created_at') else None
+    except (TypeError, ValueError):
+        created_at = None
+    if created_at and created_at.tzinfo:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    created_at = created_at or datetime.utcnow()
+    preview, line_count = make_preview(content)
+    return {
+        'title': title,
+        'content': content,  # swapped for content_hash when the chunk is written
+        'preview': preview,
+        'line_count': line_count,
+        'language': str(record.get('language') or 'javascript')[:50],
+        'is_public': bool(record.get('is_public')),
+        'created_at': created_at,
+        'hot_score': ranking.hot(0, created_at),
+    }
+
+
+def _resolve_users(usernames, known):
+    # One query per chunk for every username not seen yet
+    missing = {name for name in usernames if name and name not in known}
+    if missing:
+        found = dict(db.session.execute(
+            db.select(User.username, User.id).where(User.username.in_(missing))
+        ).all())
+        for name in missing:
+            known[name] = found.get(name)
+
+
+class _Importer:
+    def __init__(self, owner_id, include_votes):
+        self.owner_id = owner_id
+        self.include_votes = include_votes
+        self.users = {}
+        self.id_map = {}  # exported snippet id -> new id
+        self.snippets = []
+        self.votes = []
+        self.summary = Counter(snippets=0, votes=0, skipped=0)
+
+    def add(self, record):
+        kind = record.get('type')
+        if kind == 'snippet':
+            self.snippets.append(record)
+            if len(self.snippets) >= CHUNK_SIZE:
+                self.flush_snippets()
+        elif kind == 'vote' and self.include_votes:
+            self.votes.append(record)
+            if len(self.votes) >= CHUNK_SIZE:
+                self.flush_votes()
+        elif kind != 'meta':
+            self.summary['skipped'] += 1
+
+    def flush_snippets(self):
+        pending, self.snippets = self.snippets, []
+        if self.owner_id is None:
+            _resolve_users({record.get('owner') for record in pending}, self.users)
+        rows, exported_ids = [], []
+        for record in pending:
+            row = _snippet_row(record)
+            user_id = self.owner_id or self.users.get(record.get('owner'))
+            if row is None or not user_id:
+                self.summary['skipped'] += 1
+                continue
+            row['user_id'] = user_id
+            rows.append(row)
+            exported_ids.append(record.get('id'))
+        if rows:
+            hashes = SnippetBlob.store_many([row.pop('content') for row in rows])
+            for row, digest in zip(rows, hashes):
+                row['content_hash'] = digest
+            new_ids = db.session.execute(
+                db.insert(Snippet).returning(Snippet.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            self.id_map.update((old, new) for old, new in zip(exported_ids, new_ids) if old is not None)
+            search.index_snippets(new_ids)
+            if self.owner_id:
+                User.adjust_totals(self.owner_id, snippets=len(rows))
+            self.summary['snippets'] += len(rows)
+        db.session.commit()
+
+    def flush_votes(self):
+        # Votes refer to snippets by exported id, so import those first
+        self.flush_snippets()
+        pending, self.votes = self.votes, []
+        _resolve_users({record.get('user') for record in pending}, self.users)
+        rows = []
+        for record in pending:
+            snippet_id = self.id_map.get(record.get('snippet_id'))
+            user_id = self.users.get(record.get('user'))
+            if snippet_id and user_id and record.get('value') in (1, -1):
+                rows.append({'user_id': user_id, 'snippet_id': snippet_id, 'value': record['value']})
+            else:
+                self.summary['skipped'] += 1
+        if rows:
+            db.session.execute(insert_ignoring_duplicates(Vote), rows)
+            self.summary['votes'] += len(rows)
+        db.session.commit()
+
+
+def import_records(records, owner_id=None, include_votes=False):
+    # With owner_id, every snippet goes to that user (votes are never taken
+    # from a personal import). Without it, snippets keep their exported
+    # owner when that username exists here. Returns a Counter of snippets,
+    # votes and skipped records.
+    importer = _Importer(owner_id, include_votes and owner_id is None)
+    try:
+        for record in records:
+            importer.add(record)
+        importer.flush_votes()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        # Earlier chunks are committed even if a later one fails, so the
+        # counters must be brought up to date either way
+        if owner_id is None and importer.summary['snippets']:
+            site_stats.rebuild()
+            ranking.rebuild()
+        else:
+            site_stats.invalidate()
+    return importer.summary
+
+
+def describe(summary):
+    return f"{summary['snippets']} snippets, {summary['votes']} votes imported ({summary['skipped']} skipped)"
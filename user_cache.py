@@ -0,0 +1,62 @@
+import json
+import os
+from flask import current_app
+from flask_login import UserMixin
+from models import db, User
+import cache
+
+# Cached identities for Flask-Login.
+#
+# load_user() runs on every authenticated request, and the nav bar badge
+# used to look the same user up again. current_user is now a SessionUser:
+# a plain object holding only the fields sessions and badges need, cached
+# under user:<id> in the shared cache backend for USER_CACHE_TTL seconds.
+# Routes that change those fields, or delete the user, call forget() after
+# committing. With the per-process memory backend, other workers may
+# serve the old values until the TTL runs out. With CACHE_BACKEND=redis,
+# forget() takes effect everywhere immediately. USER_CACHE_TTL=0 disables
+# the cache.
+#
+# Code that needs the full row (relationships, password hash) loads it with
+# db.session.get(User, current_user.id).
+
+FIELDS = ('id', 'username', 'country', 'is_moderator')
+
+
+class SessionUser(UserMixin):
+    def __init__(self, id, username, country, is_moderator):
+        self.id = id
+        self.username = username
+        self.country = country
+        self.is_moderator = bool(is_moderator)
+
+    def __repr__(self):
+        return f"<SessionUser {self.id} {self.username}>"
+
+
+def init_app(app):
+    app.config.setdefault('USER_CACHE_TTL', int(os.environ.get('USER_CACHE_TTL', 30)))
+
+
+def _key(user_id):
+    return f"user:{user_id}"
+
+
+def load(user_id):
+    ttl = current_app.config['USER_CACHE_TTL']
+    raw = cache.backend.get(_key(user_id)) if ttl else None
+    if raw is None:
+        row = db.session.execute(
+            db.select(*(getattr(User, field) for field in FIELDS)).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        raw = json.dumps(list(row))
+        if ttl:
+            cache.backend.set(_key(user_id), raw, ttl=ttl)
+    return SessionUser(*json.loads(raw))
+
+
+def forget(user_id):
+    # Call after committing a change to a user's cached fields or deleting them
+    cache.backend.delete(_key(user_id))
@@ -0,0 +1,139 @@
+import atexit
+import os
+import threading
+from sqlalchemy import bindparam
+from sqlalchemy.exc import NoResultFound
+from models import db, User, Snippet
+import stats as site_stats
+import ranking
+import cache
+
+# Optional write coalescing for vote counters.
+#
+# Each vote row is always written and committed by the request itself. In the
+# default mode the snippet counters and owner reputation move in the same
+# transaction, so a viral snippet makes every voter queue on its row lock.
+# With VOTE_COALESCE on, the request only records the score delta here. A
+# background thread per process applies the summed deltas every
+# VOTE_COALESCE_INTERVAL seconds, with one executemany UPDATE per batch (plus
+# one for the hot scores) and one owner update each. A snippet receiving hundreds of votes a second then
+# takes one counter write per interval.
+#
+# Counters lag the vote table by up to one interval. Deltas still buffered
+# when a process dies are lost, and so is any drift from a snippet deleted
+# before its batch landed; `flask rebuild-stats` repairs both.
+
+_snippets = Snippet.__table__
+_counter_update = db.update(_snippets).where(_snippets.c.id == bindparam('b_id')).values(
+    score=_snippets.c.score + bindparam('b_score'),
+    upvotes=_snippets.c.upvotes + bindparam('b_up'),
+    downvotes=_snippets.c.downvotes + bindparam('b_down'),
+)
+
+
+class VoteCoalescer:
+    def __init__(self):
+        self.app = None
+        self.pending = {}  # snippet_id -> [owner_id, score, upvotes, downvotes]
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def init_app(self, app):
+        app.config.setdefault('VOTE_COALESCE', os.environ.get('VOTE_COALESCE') == '1')
+        app.config.setdefault('VOTE_COALESCE_INTERVAL', float(os.environ.get('VOTE_COALESCE_INTERVAL', 0.5)))
+        self.app = app
+        atexit.register(self.shutdown)
+
+    @property
+    def enabled(self):
+        return self.app.config['VOTE_COALESCE']
+
+    def add(self, snippet_id, owner_id, old_value, new_value):
+        # Call after the vote row has committed
+        self._ensure_started()
+        with self.lock:
+            entry = self.pending.setdefault(snippet_id, [owner_id, 0, 0, 0])
+            entry[1] += new_value - old_value
+            entry[2] += (new_value == 1) - (old_value == 1)
+            entry[3] += (new_value == -1) - (old_value == -1)
+
+    def pending_score(self, snippet_id):
+        with self.lock:
+            entry = self.pending.get(snippet_id)
+            return entry[1] if entry else 0
+
+    def _ensure_started(self):
+        if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            self.pending = {}
+            self.stop.clear()
+            self.thread = threading.Thread(target=self._run, name='vote-coalescer', daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def _run(self):
+        while not self.stop.wait(self.app.config['VOTE_COALESCE_INTERVAL']):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        batch = {sid: entry for sid, entry in batch.items() if any(entry[1:])}
+        if not batch:
+            return
+        with self.app.app_context():
+            try:
+                owners = self._apply(batch)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Failed to apply %d coalesced vote deltas; retrying', len(batch))
+                self._restore(batch)
+                return
+            names = {}
+            for row in owners:
+                site_stats.record_totals(row)
+                names[row.id] = row.username
+            for snippet_id, entry in batch.items():
+                if entry[0] in names:
+                    cache.snippet_changed(snippet_id, names[entry[0]])
+
+    def _apply(self, batch):
+        # Sorted ids give every writer the same lock order
+        db.session.execute(_counter_update, [
+            {'b_id': sid, 'b_score': entry[1], 'b_up': entry[2], 'b_down': entry[3]}
+            for sid, entry in sorted(batch.items())
+        ])
+        ranking.refresh_many(sorted(batch))
+        reputation = {}
+        for owner_id, score, _, _ in batch.values():
+            reputation[owner_id] = reputation.get(owner_id, 0) + score
+        owners = []
+        for owner_id, delta in sorted(reputation.items()):
+            try:
+                owners.append(User.adjust_totals(owner_id, reputation=delta))
+            except NoResultFound:
+                pass  # owner deleted since the vote; nothing left to credit
+        db.session.commit()
+        return owners
+
+    def _restore(self, batch):
+        with self.lock:
+            for sid, (owner_id, score, up, down) in batch.items():
+                entry = self.pending.setdefault(sid, [owner_id, 0, 0, 0])
+                entry[1] += score
+                entry[2] += up
+                entry[3] += down
+
+    def shutdown(self, timeout=10):
+        if self.thread and self.thread.is_alive() and self.pid == os.getpid():
+            self.stop.set()
+            self.thread.join(timeout)
+
+
+coalescer = VoteCoalescer()
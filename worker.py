@@ -0,0 +1,21 @@
+import signal
+import sys
+from app import app
+from jobs import queue as job_queue, Worker
+
+# Runs background jobs (see jobs.py) until stopped. With JOBS_MODE=worker,
+# start one or more beside the web processes:
+#     python worker.py            # --burst exits once the queue is empty
+# SIGTERM/SIGINT let the current job finish before exiting.
+
+if app.config['CACHE_BACKEND'] == 'memory':
+    # Jobs here bump cache stamps in this process only
+    print('⚠️  CACHE_BACKEND=memory: pages cached by the web process will not see changes made by jobs '
+          'run here until they expire; use CACHE_BACKEND=redis with a separate worker', file=sys.stderr)
+
+worker = Worker(job_queue)
+for sig in (signal.SIGTERM, signal.SIGINT):
+    signal.signal(sig, lambda *_: worker.stop())
+
+done = worker.run(burst='--burst' in sys.argv[1:])
+print(f"✅ Ran {done} jobs.")
@@ -0,0 +1,153 @@
+from models import db, User, Snippet, Vote, AdminLog
+from audit import writer as audit_writer
+from cache import snippet_changed
+from jobs import queue as job_queue
+from votes import coalescer as vote_coalescer
+import cache
+import ranking
+import search
+import stats as site_stats
+import user_cache
+
+# Write layer for snippets and votes, shared by the HTML views and the JSON
+# API (the read side lives in queries.py). Each helper commits the change
+# together with its search index entry and counters. Once the commit has
+# landed it patches the leaderboards, bumps the cache stamps and queues the
+# audit entry. `author`/`actor` is the acting user: current_user, or
+# anything else carrying id and username.
+#
+# Work too heavy for a request runs as background jobs (see jobs.py); the
+# handlers are registered at the bottom of this module.
+
+
+def create_snippet(author, title, content, language, is_public):
+    snippet = Snippet(title=title, content=content, language=language, is_public=is_public, user_id=author.id)
+    db.session.add(snippet)
+    db.session.flush()
+    search.index_snippet(snippet.id)
+    owner_totals = User.adjust_totals(author.id, snippets=1)
+    db.session.commit()
+    site_stats.record_totals(owner_totals)
+    snippet_changed(snippet.id, author.username)
+    audit_writer.log(author.id, "Create Snippet", f"Created snippet '{title}'")
+    return snippet
+
+
+def update_snippet(snippet, author, **fields):
+    # fields: any of title, content, language, is_public
+    for name, value in fields.items():
+        setattr(snippet, name, value)
+    db.session.flush()
+    search.index_snippet(snippet.id)
+    db.session.commit()
+    snippet_changed(snippet.id, author.username)
+    audit_writer.log(author.id, "Edit Snippet", f"Edited snippet '{snippet.title}'")
+    return snippet
+
+
+def set_visibility(snippet, author, is_public):
+    snippet.is_public = is_public
+    db.session.commit()
+    snippet_changed(snippet.id, author.username)
+    audit_writer.log(author.id, "Toggle Privacy",
+                     f"Snippet '{snippet.title}' is now {'Public' if snippet.is_public else 'Private'}")
+
+
+def delete_snippet(snippet, actor):
+    # Permission checks are the caller's; anyone but the owner is staff here
+    snippet_id, title, owner_id = snippet.id, snippet.title, snippet.user_id
+    owner_name = snippet.owner.username
+    owner_totals = User.adjust_totals(owner_id, snippets=-1, reputation=-snippet.score)
+    search.remove_snippet(snippet_id)
+    db.session.delete(snippet)
+    db.session.commit()
+    site_stats.record_totals(owner_totals)
+    snippet_changed(snippet_id, owner_name)
+    if owner_id != actor.id:
+        audit_writer.log(actor.id, "Staff Delete Snippet", f"Deleted snippet '{title}' owned by {owner_name}")
+    else:
+        audit_writer.log(actor.id, "Delete Snippet", f"Deleted snippet '{title}'")
+
+
+def cast_vote(snippet, user_id, value):
+    # Toggle-or-switch vote semantics (see Vote.cast); returns the new score
+    old_value, new_value = Vote.cast(user_id, snippet.id, value)
+    if vote_coalescer.enabled:
+        # Counters catch up in the next batch; see votes.py
+        score = snippet.score
+        db.session.commit()
+        vote_coalescer.add(snippet.id, snippet.user_id, old_value, new_value)
+        return score + vote_coalescer.pending_score(snippet.id)
+    # Counters move in the same transaction as the vote row itself
+    score = Snippet.apply_vote_change(snippet.id, old_value, new_value)
+    ranking.refresh(snippet.id, score, snippet.created_at)
+    owner_totals = User.adjust_totals(snippet.user_id, reputation=new_value - old_value)
+    db.session.commit()
+    site_stats.record_totals(owner_totals)
+    snippet_changed(snippet.id, owner_totals.username)
+    return score
+
+
+def delete_user(user):
+    # Lock the account and take its snippets out of public view right away,
+    # then leave the actual deletion to the delete_user job (purge_user)
+    user_id, username = user.id, user.username
+    # No password verifies against '!' (see passwords.py)
+    db.session.execute(db.update(User).where(User.id == user_id).values(password_hash='!')
+                       .execution_options(synchronize_session=False))
+    hidden = db.session.execute(
+        db.update(Snippet).where(Snippet.user_id == user_id).values(is_public=False).returning(Snippet.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    job_queue.enqueue('delete_user', user_id=user_id)
+    user_cache.forget(user_id)
+    # The snippet pages too, or conditional GETs keep answering 304 with
+    # the cached page until the job has run
+    cache.touch('feed', f'profile:{username}', 'stats', *(f'snippet:{snippet_id}' for snippet_id in hidden))
+
+
+# Background jobs
+
+@job_queue.handler('delete_user')
+def purge_user(user_id):
+    # Delete a user with their snippets, votes and logs in set-based
+    # statements, one transaction. Their votes are first backed out of the
+    # counters and rankings of every snippet they voted on.
+    if db.session.get(User, user_id) is None:
+        return
+    Vote.retract_all(user_id)
+    ranking.refresh_many(db.select(Vote.snippet_id).where(Vote.user_id == user_id))
+    search.remove_user(user_id)
+    owned = db.select(Snippet.id).where(Snippet.user_id == user_id)
+    for statement in (
+        db.delete(Vote).where(db.or_(Vote.user_id == user_id, Vote.snippet_id.in_(owned))),
+        db.delete(Snippet).where(Snippet.user_id == user_id),
+        db.delete(AdminLog).where(AdminLog.admin_id == user_id),
+        db.delete(User).where(User.id == user_id),
+    ):
+        db.session.execute(statement.execution_options(synchronize_session=False))
+    db.session.commit()
+    user_cache.forget(user_id)
+    site_stats.invalidate()
+    cache.touch('site', 'stats')
+
+
+@job_queue.handler('reconcile_scores')
+def reconcile_scores():
+    # Snippet vote counters first, then the user totals derived from them.
+    # Returns the number of (snippets, users) whose counters were corrected.
+    snippets = Snippet.reconcile_scores()
+    users = User.reconcile_totals()
+    if snippets:
+        ranking.rebuild()
+    if snippets or users:
+        site_stats.invalidate()
+        cache.touch('site', 'stats')
+    return snippets, users
+
+
+@job_queue.handler('rebuild_stats')
+def rebuild_stats():
+    site_stats.rebuild()
+    ranking.rebuild()
+    cache.touch('site', 'stats')